@@ -0,0 +1,454 @@
+# offline benchmark of the whole daily/intraday path: universe screening, get_historical_klines,
+# calculate_financial_indicators, save_data_into_database and check_symbols, every stage timed on
+# its own and then together as the collector's pipelined run followed by the checker
+#
+# binance is replaced by mock_binance_server (pagination, latency, weight headers) and the
+# database by a pluggable store: without arguments an in-memory table that answers the few
+# statements the collector and the checker send, after escaping them like pymysql, so the client
+# side of every write is real but the server side is not. Point BENCH_MYSQL_HOST/USER/PASSWORD/
+# DATABASE at a local MySQL-compatible server with the tables created as in production to time the
+# server as well; the bench symbols (BENCH*USDT) are deleted from it before every scenario.
+#
+# the real collector and checker modules run unchanged, their PooledDB is swapped for the store
+# before they are imported and their URLs and caches are pointed at the mock and a temporary
+# directory. Results are written as JSON to --output so runs can be compared over time
+#
+#   python bench_end_to_end.py --symbols 10,100,1000 --intervals 1d,1m --output bench_results.json
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import dbutils.pooled_db
+import numpy as np
+import pandas as pd
+import pymysql
+
+from bench_save_data import RecordingConnection
+from mock_binance_server import INTERVAL_MS, MockMarket, start_server, DEFAULT_LATENCY
+
+DAILY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1 Binance_Spot_Market_Data', '1 Daily_Data_')
+CHECKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '* Data_Check_')
+CHECKER_FILE = os.path.join(CHECKER_DIR, '2 Check_Binance_Spot_Historical_dayData.py')
+sys.path += [DAILY_DIR, CHECKER_DIR]
+from database_writer import INSERT_COLUMNS, INTERVAL_TABLES
+from kline_digest import DIGEST_TABLE
+
+
+
+SYMBOL_COUNTS = [10, 100, 1000]
+INTERVALS = ['1d', '1m']
+DAILY_YEARS = 8
+# 1m history per symbol, 3 days are 4320 bars or 5 pages
+MINUTE_DAYS = 3
+# the mock is not rate limited, the real budget would turn a 1000-symbol run into hours of waiting;
+# set it to 1100 to measure the limiter as well
+BENCH_WEIGHT_BUDGET = 10 ** 9
+DEFAULT_OUTPUT = 'bench_results.json'
+
+# the columns the collector and the checker read back, the indicators are only written
+STORED_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trades', 'row_hash']
+
+
+
+# in-process stand-in for the kline tables, one frame per (table, symbol)
+class MemoryStore:
+    name = 'memory'
+
+    def __init__(self):
+        self.tables = {}
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    # PooledDB(...) is replaced by this
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def connection(self):
+        return MemoryConnection(self)
+
+    def reset(self, symbols):
+        with self.lock:
+            self.tables.clear()
+            self.digests.clear()
+
+    def rows(self, table):
+        return sum(len(df) for (t, _), df in self.tables.items() if t == table)
+
+    def upsert(self, table, rows):
+        positions = [INSERT_COLUMNS.index(column) for column in STORED_COLUMNS]
+        width = len(INSERT_COLUMNS)
+        values = np.array(rows, dtype=object).reshape(-1, width)
+        affected = 0
+        with self.lock:
+            for symbol in pd.unique(values[:, 0]):
+                new = pd.DataFrame(values[values[:, 0] == symbol][:, positions], columns=STORED_COLUMNS)
+                new = new.astype({'timestamp': 'int64', 'trades': 'int64'})
+                old = self.tables.get((table, symbol))
+                if old is None:
+                    merged = new
+                    affected += len(new)
+                else:
+                    affected += len(new) + int(new['timestamp'].isin(old['timestamp']).sum())
+                    merged = pd.concat([old, new], ignore_index=True).drop_duplicates('timestamp', keep='last')
+                self.tables[(table, symbol)] = merged.sort_values('timestamp', ignore_index=True)
+        return affected
+
+    def select_range(self, table, columns, symbol, start_ts, end_ts):
+        df = self.tables.get((table, symbol))
+        if df is None:
+            return []
+        ts = df['timestamp'].to_numpy()
+        return list(df.loc[(ts >= start_ts) & (ts <= end_ts), columns].itertuples(index=False, name=None))
+
+    def time_ranges(self, table):
+        return [(symbol, int(df['timestamp'].iat[0]), int(df['timestamp'].iat[-1]), len(df))
+                for (t, symbol), df in self.tables.items() if t == table and len(df)]
+
+
+class MemoryConnection:
+
+    def __init__(self, store):
+        self.store = store
+        self.escaper = RecordingConnection()
+
+    def cursor(self, cursor_class=None):
+        return MemoryCursor(self)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryCursor:
+    INSERT = re.compile(r'INSERT INTO (\S+) \(')
+    SELECT_RANGE = re.compile(r'SELECT (.+?) FROM (\S+) WHERE symbol = %s AND timestamp BETWEEN %s AND %s')
+    SELECT_DIGESTS = re.compile(rf'SELECT month, row_count, digest FROM {re.escape(DIGEST_TABLE)} WHERE symbol = %s')
+    TIME_RANGES = re.compile(r'SELECT symbol, MIN\(timestamp\).* FROM (\S+) GROUP BY symbol')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.store = connection.store
+        self.rows = []
+        self.position = 0
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    # the statement is escaped like pymysql would before it is interpreted
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        if params is not None:
+            sql % tuple(self.connection.escaper.escape(value) for value in params)
+        self.rows, self.position = [], 0
+
+        match = self.INSERT.match(sql)
+        if match and match.group(1) != DIGEST_TABLE:
+            self.rowcount = self.store.upsert(match.group(1), params)
+            return self.rowcount
+        match = self.SELECT_RANGE.match(sql)
+        if match:
+            columns = [column.strip() for column in match.group(1).split(',')]
+            self.rows = self.store.select_range(match.group(2), columns, *params)
+        elif self.SELECT_DIGESTS.match(sql):
+            self.rows = list(self.store.digests.get(params[0], {}).items())
+            self.rows = [(month, row_count, digest) for month, (row_count, digest) in self.rows]
+        elif self.TIME_RANGES.match(sql):
+            self.rows = self.store.time_ranges(self.TIME_RANGES.match(sql).group(1))
+        else:
+            raise NotImplementedError(f'memory store does not handle : {sql[:80]}')
+        self.rowcount = len(self.rows)
+        return self.rowcount
+
+    def executemany(self, sql, rows):
+        sql = ' '.join(sql.split())
+        if not sql.startswith(f'INSERT INTO {DIGEST_TABLE} '):
+            raise NotImplementedError(f'memory store does not handle : {sql[:80]}')
+        with self.store.lock:
+            for symbol, month, row_count, digest in rows:
+                self.store.digests.setdefault(symbol, {})[month] = (row_count, digest)
+        self.rowcount = len(rows)
+        return self.rowcount
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def fetchmany(self, size):
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+
+# a real server, the collector and the checker share one pool to it
+class MySQLStore:
+    name = 'mysql'
+
+    def __init__(self, max_connections=8):
+        self.pool = dbutils.pooled_db.PooledDB(
+            creator=pymysql,
+            maxconnections=max_connections,
+            blocking=True,
+            host=os.getenv('BENCH_MYSQL_HOST'),
+            user=os.getenv('BENCH_MYSQL_USER'),
+            password=os.getenv('BENCH_MYSQL_PASSWORD'),
+            database=os.getenv('BENCH_MYSQL_DATABASE'),
+            charset='utf8',
+            autocommit=True,
+            local_infile=True
+        )
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def connection(self):
+        return self.pool.connection()
+
+    def reset(self, symbols):
+        connection = self.pool.connection()
+        try:
+            with connection.cursor() as cursor:
+                for table in set(INTERVAL_TABLES.values()) | {DIGEST_TABLE}:
+                    cursor.execute(f"DELETE FROM {table} WHERE symbol LIKE 'BENCH%%USDT'")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def rows(self, table):
+        connection = self.pool.connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE symbol LIKE 'BENCH%%USDT'")
+                return int(cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+
+
+# collector and checker modules wired to `store`
+def load_modules(store, weight_budget):
+    original_pool = dbutils.pooled_db.PooledDB
+    dbutils.pooled_db.PooledDB = store
+    try:
+        import binance_spot_historical_day_data as collector
+        spec = importlib.util.spec_from_file_location('bench_checker', CHECKER_FILE)
+        checker = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(checker)
+    finally:
+        dbutils.pooled_db.PooledDB = original_pool
+    logging.getLogger().setLevel(logging.WARNING)
+
+    import binance_klines_fetcher as fetcher
+    fetcher.limiter.budget = weight_budget
+    # the mock is plain http, give it the same connection pool size as https
+    fetcher.session.mount('http://', fetcher.session.get_adapter('https://'))
+    return collector, checker, fetcher
+
+
+def point_at(modules, base_url):
+    collector, checker, fetcher = modules
+    fetcher.BINANCE_KLINES_URL = base_url + '/api/v3/klines'
+    fetcher.BINANCE_TIME_URL = base_url + '/api/v3/time'
+    fetcher.BINANCE_TICKER_24H_URL = base_url + '/api/v3/ticker/24hr'
+    collector.BINANCE_EXCHANGE_URL = base_url + '/api/v3/exchangeInfo'
+
+
+# fresh kline cache and universe cache for the collector and the checker
+def reset_caches(collector, checker, directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    from kline_cache import KlineCache
+    from universe_cache import UniverseCache
+    collector.kline_cache = checker.kline_cache = KlineCache(os.path.join(directory, 'klines'))
+    collector.universe_cache = UniverseCache(os.path.join(directory, 'universe_cache.json'))
+
+
+def summarize(seconds, rows):
+    seconds = np.array(seconds) if seconds else np.zeros(1)
+    total = float(seconds.sum())
+    return {
+        'seconds': round(total, 3),
+        'mean_ms': round(float(seconds.mean()) * 1000, 2),
+        'p95_ms': round(float(np.percentile(seconds, 95)) * 1000, 2),
+        'rows_per_second': round(rows / total, 1) if total else 0.0,
+    }
+
+
+# every stage on its own, one symbol after another so only one symbol's frames are in memory
+def run_stages(collector, checker, symbols, start_ms, interval):
+    timings = {name: [] for name in ['get_historical_klines', 'calculate_financial_indicators',
+                                     'save_data_into_database', 'check_symbols']}
+    rows = 0
+
+    started = time.perf_counter()
+    universe = collector.refresh_aim_symbols()
+    universe_seconds = time.perf_counter() - started
+
+    for symbol in symbols:
+        started = time.perf_counter()
+        df = collector.get_historical_klines(symbol, start_ms, interval)
+        timings['get_historical_klines'].append(time.perf_counter() - started)
+        if df is None:
+            continue
+        rows += len(df)
+
+        started = time.perf_counter()
+        df = collector.calculate_financial_indicators(df)
+        timings['calculate_financial_indicators'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        collector.save_data_into_database(df, symbol, interval=interval)
+        timings['save_data_into_database'].append(time.perf_counter() - started)
+
+        # the checker verifies the daily table only
+        if interval == '1d':
+            started = time.perf_counter()
+            checker.check_symbols(symbol, int(df['timestamp'].iat[0]), int(df['timestamp'].iat[-1]))
+            timings['check_symbols'].append(time.perf_counter() - started)
+
+    stages = {'universe': {'seconds': round(universe_seconds, 3), 'symbols_selected': len(universe)}}
+    stages.update({name: summarize(seconds, rows) for name, seconds in timings.items() if seconds})
+    return stages, rows
+
+
+# collect_pipelined for `interval` (fetch, indicators in processes, store overlapping), then the checker
+def run_end_to_end(collector, checker, symbols, start_ms, interval):
+    def store(symbol, df):
+        collector.save_data_into_database(df, symbol, interval=interval)
+        return True
+
+    started = time.perf_counter()
+    pipeline = collector.collect_pipelined(symbols, start_ms, interval, store=store)
+    collect_seconds = time.perf_counter() - started
+
+    check_seconds = None
+    if interval == '1d':
+        started = time.perf_counter()
+        summary = checker.check_all_symbols(checker.get_symbols_time_range())
+        check_seconds = time.perf_counter() - started
+        if summary['mismatching'] or summary['failed']:
+            logging.warning(f"⚠️ check found mismatching {summary['mismatching']} failed {summary['failed']}")
+
+    return {
+        'seconds': round(collect_seconds + (check_seconds or 0.0), 3),
+        'collect_seconds': round(collect_seconds, 3),
+        'check_seconds': round(check_seconds, 3) if check_seconds is not None else None,
+        'pipeline': pipeline['stages'],
+    }
+
+
+def run_scenario(store, modules, cache_directory, symbol_count, interval, history_ms, latency):
+    collector, checker, fetcher = modules
+    symbols = [f'BENCH{i:04d}USDT' for i in range(symbol_count)]
+    now_ms = int(time.time() * 1000)
+    start_ms = now_ms - history_ms
+    # a quarter of the symbols' histories start later, like listings during the range
+    market = MockMarket(symbols, start_ms, now_ms, history_ms // 4)
+    server, base_url = start_server(market, latency)
+    point_at(modules, base_url)
+    table = INTERVAL_TABLES[interval]
+    print(f'{symbol_count} symbols x {interval} over {history_ms // INTERVAL_MS[interval]} bars')
+
+    try:
+        store.reset(symbols)
+        reset_caches(collector, checker, cache_directory)
+        fetcher.limiter.peak_used_weight = 0
+        stages, rows = run_stages(collector, checker, symbols, start_ms, interval)
+        stage_requests = market.requests.value
+        rows_stored = store.rows(table)
+
+        store.reset(symbols)
+        reset_caches(collector, checker, cache_directory)
+        end_to_end = run_end_to_end(collector, checker, symbols, start_ms, interval)
+        end_to_end_requests = market.requests.value - stage_requests
+    finally:
+        server.terminate()
+
+    for name, stage in stages.items():
+        print(f'  {name:<32} {stage["seconds"]:9.3f} s')
+    print(f'  {"end to end":<32} {end_to_end["seconds"]:9.3f} s')
+    return {
+        'symbols': symbol_count,
+        'interval': interval,
+        'bars_per_symbol': history_ms // INTERVAL_MS[interval],
+        'rows_fetched': rows,
+        'rows_stored': rows_stored,
+        'requests': stage_requests,
+        'requests_end_to_end': end_to_end_requests,
+        'peak_used_weight': fetcher.limiter.peak_used_weight,
+        'stages': stages,
+        'end_to_end': end_to_end,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='offline end-to-end benchmark of the collector and the checker')
+    parser.add_argument('--symbols', default=','.join(map(str, SYMBOL_COUNTS)))
+    parser.add_argument('--intervals', default=','.join(INTERVALS))
+    parser.add_argument('--years', type=int, default=DAILY_YEARS, help='daily history per symbol')
+    parser.add_argument('--minute-days', type=int, default=MINUTE_DAYS, help='1m history per symbol')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='seconds per mock response')
+    parser.add_argument('--weight-budget', type=int, default=BENCH_WEIGHT_BUDGET)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    store = MySQLStore() if os.getenv('BENCH_MYSQL_HOST') else MemoryStore()
+    modules = load_modules(store, args.weight_budget)
+    cache_directory = tempfile.mkdtemp(prefix='bench_end_to_end_')
+
+    history = {'1d': args.years * 365 * INTERVAL_MS['1d'], '1m': args.minute_days * 1440 * INTERVAL_MS['1m']}
+    results = {
+        'started_at': pd.Timestamp.now(tz='UTC').isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'store': store.name,
+            'latency_seconds': args.latency,
+            'weight_budget': args.weight_budget,
+        },
+        'scenarios': [],
+    }
+    try:
+        for interval in args.intervals.split(','):
+            for symbol_count in map(int, args.symbols.split(',')):
+                results['scenarios'].append(run_scenario(store, modules, cache_directory, symbol_count,
+                                                         interval, history[interval], args.latency))
+                with open(args.output, 'w') as f:
+                    json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(cache_directory, ignore_errors=True)
+    print(f'results written to {args.output}')
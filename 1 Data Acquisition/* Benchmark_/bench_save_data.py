@@ -0,0 +1,132 @@
+# benchmark the old iterrows + executemany write path against database_writer
+#
+# without arguments the statements go to a recording cursor that escapes every value exactly like
+# pymysql but never talks to a server, so only the client side (tuple building, escaping, statement
+# size) is measured. Point BENCH_MYSQL_HOST/USER/PASSWORD/DATABASE at a local MySQL-compatible
+# server (e.g. a mysql or mariadb container with the kline table created as `***`) to include the
+# server side as well.
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pymysql
+from pymysql import converters
+from pymysql.cursors import Cursor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '1 Binance_Spot_Market_Data', '1 Daily_Data_'))
+from database_writer import (INSERT_COLUMNS, HASH_COLUMNS, build_value_rows, upsert_rows, build_upsert_sql,
+                             load_data_rows, compute_row_hashes)
+
+
+
+SYMBOLS = 10
+YEARS = 8
+BATCH_SIZES = [250, 1000, 4000]
+
+
+
+# escapes like a real pymysql connection and only records what would be sent
+class RecordingConnection:
+    encoding = 'utf8'
+    encoders = converters.encoders
+
+    def __init__(self):
+        self.statements = 0
+        self.bytes_sent = 0
+
+    def escape(self, obj, mapping=None):
+        if isinstance(obj, str):
+            return "'" + converters.escape_string(obj) + "'"
+        return converters.escape_item(obj, self.encoding, mapping=mapping or self.encoders)
+
+
+class RecordingCursor(Cursor):
+
+    def nextset(self):
+        return None
+
+    def _query(self, q):
+        self.connection.statements += 1
+        self.connection.bytes_sent += len(q)
+        self.rowcount = 0
+        return 0
+
+
+def make_indicator_frame(rows, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'timestamp': 1500000000000 + np.arange(rows, dtype='int64') * 86400000,
+        'trades': rng.integers(100, 100000, rows),
+    })
+    df['trade_date'] = pd.to_datetime(df['timestamp'], unit='ms').dt.date
+    for column in HASH_COLUMNS:
+        if column not in df:
+            values = rng.normal(100, 10, rows)
+            # the long windows are NULL at the start like in the real table
+            values[:200 if column.endswith('_200') else 20] = np.nan
+            df[column] = values
+    df['row_hash'] = compute_row_hashes(df)
+    return df
+
+
+# the write path before database_writer, kept here as the baseline; the frames still carried
+# None instead of NaN back then
+def legacy_save(cursor, df, symbol):
+    df = df.replace({np.nan: None})
+    sql = build_upsert_sql(1)
+    values = [tuple([symbol] + [row[column] for column in INSERT_COLUMNS[1:]]) for _, row in df.iterrows()]
+    cursor.execute("SELECT COUNT(*) FROM *** WHERE symbol = %s", (symbol,))
+    cursor.executemany(sql, values)
+    cursor.execute("SELECT COUNT(*) FROM *** WHERE symbol = %s", (symbol,))
+
+
+def bulk_save(cursor, df, symbol, batch_size):
+    upsert_rows(cursor, build_value_rows(df, symbol), batch_size)
+
+
+def load_data_save(cursor, df, symbol):
+    load_data_rows(cursor, build_value_rows(df, symbol))
+
+
+def connect():
+    if os.getenv('BENCH_MYSQL_HOST'):
+        connection = pymysql.connect(
+            host=os.getenv('BENCH_MYSQL_HOST'),
+            user=os.getenv('BENCH_MYSQL_USER'),
+            password=os.getenv('BENCH_MYSQL_PASSWORD'),
+            database=os.getenv('BENCH_MYSQL_DATABASE'),
+            charset='utf8',
+            autocommit=True,
+            local_infile=True
+        )
+        return connection, connection.cursor()
+    connection = RecordingConnection()
+    return connection, RecordingCursor(connection)
+
+
+def run(name, save, frames):
+    connection, cursor = connect()
+    started = time.perf_counter()
+    for symbol, df in frames.items():
+        save(cursor, df, symbol)
+    elapsed = time.perf_counter() - started
+    rows = sum(len(df) for df in frames.values())
+    detail = ''
+    if isinstance(connection, RecordingConnection):
+        detail = f'  {connection.statements} statements, {connection.bytes_sent / 1e6:.1f} MB'
+    print(f'{name:<28} {elapsed:8.3f} s  {rows / elapsed:10.0f} rows/s{detail}')
+    return elapsed
+
+
+if __name__ == '__main__':
+    frames = {f'SYM{i}USDT': make_indicator_frame(YEARS * 365, i) for i in range(SYMBOLS)}
+    print(f'{SYMBOLS} symbols x {YEARS * 365} daily rows')
+    run('legacy iterrows+executemany', legacy_save, frames)
+    for batch_size in BATCH_SIZES:
+        run(f'bulk batch_size={batch_size}', lambda c, df, s: bulk_save(c, df, s, batch_size), frames)
+    if os.getenv('BENCH_MYSQL_HOST'):
+        run('staging + LOAD DATA', load_data_save, frames)
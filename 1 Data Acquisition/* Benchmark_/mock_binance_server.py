@@ -0,0 +1,143 @@
+# local stand-in for the binance REST endpoints the collector and the checker use
+#
+# /api/v3/klines, /api/v3/exchangeInfo, /api/v3/time and /api/v3/ticker/24hr are served from a
+# deterministic synthetic market: every bar is a function of (symbol, open time), so any page
+# can be generated on demand and two requests for the same range return the same bars.
+# Pagination follows binance (startTime/endTime/limit, at most 1000 bars), every response waits
+# `latency` seconds and carries X-MBX-USED-WEIGHT-1M for the fixed minute window it falls in.
+# the server runs in its own process so generating pages does not compete with the client for the GIL
+
+import json
+import multiprocessing
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+
+INTERVAL_MS = {
+    '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000,
+    '30m': 1800000, '1h': 3600000, '2h': 7200000, '4h': 14400000,
+    '6h': 21600000, '8h': 28800000, '12h': 43200000, '1d': 86400000
+}
+ENDPOINT_WEIGHTS = {'/api/v3/klines': 2, '/api/v3/time': 1, '/api/v3/exchangeInfo': 20, '/api/v3/ticker/24hr': 80}
+MAX_LIMIT = 1000
+DEFAULT_LATENCY = 0.02
+
+
+
+def _seed(symbol):
+    return zlib.crc32(symbol.encode())
+
+
+# raw kline rows for the open times in `timestamps`, strings for prices like the real API
+def synthetic_klines(symbol, timestamps, interval_ms):
+    seed = _seed(symbol)
+    steps = timestamps // interval_ms
+    base = 10 + seed % 1000
+    wave = np.sin(steps / 50.0 + seed % 7) * 0.2 + np.sin(steps / 7.0) * 0.05
+    close = base * (1 + wave)
+    open_ = base * (1 + np.sin((steps - 1) / 50.0 + seed % 7) * 0.2 + np.sin((steps - 1) / 7.0) * 0.05)
+    high = np.maximum(open_, close) * 1.01
+    low = np.minimum(open_, close) * 0.99
+    volume = 1000 + (steps * 7919 + seed) % 5000
+    quote_volume = volume * close
+    trades = 100 + (steps * 104729 + seed) % 900
+    return [[int(t), f'{o:.8f}', f'{h:.8f}', f'{l:.8f}', f'{c:.8f}', f'{v:.8f}', int(t + interval_ms - 1),
+             f'{q:.8f}', int(n), '0', '0', '0']
+            for t, o, h, l, c, v, q, n in zip(timestamps, open_, high, low, close, volume, quote_volume, trades)]
+
+
+class MockMarket:
+
+    # every symbol lists at listed_from or up to spread_ms later, always at the same offset
+    def __init__(self, symbols, listed_from, now_ms, spread_ms=0):
+        self.symbols = list(symbols)
+        self.now_ms = now_ms
+        self.listed_at = {symbol: listed_from + (_seed(symbol) % spread_ms if spread_ms else 0) for symbol in self.symbols}
+        # shared with the server process
+        self.requests = multiprocessing.Value('q', 0)
+        self._window = multiprocessing.Value('q', -1)
+        self._used = multiprocessing.Value('q', 0)
+
+    def charge(self, weight):
+        window = int(time.time()) // 60
+        with self.requests.get_lock():
+            if window != self._window.value:
+                self._window.value, self._used.value = window, 0
+            self._used.value += weight
+            self.requests.value += 1
+            return self._used.value
+
+    def klines(self, symbol, interval, start_ms, end_ms, limit):
+        interval_ms = INTERVAL_MS[interval]
+        first = max(start_ms, self.listed_at[symbol])
+        first = -(-first // interval_ms) * interval_ms
+        last = min(end_ms, self.now_ms)
+        if last < first:
+            return []
+        count = min(limit, (last - first) // interval_ms + 1)
+        return synthetic_klines(symbol, first + np.arange(count, dtype='int64') * interval_ms, interval_ms)
+
+
+def _handler(market, latency):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, used):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-MBX-USED-WEIGHT-1M', str(used))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            used = market.charge(ENDPOINT_WEIGHTS.get(url.path, 1))
+            time.sleep(latency)
+
+            if url.path == '/api/v3/time':
+                self._send(200, {'serverTime': int(time.time() * 1000)}, used)
+            elif url.path == '/api/v3/exchangeInfo':
+                self._send(200, {'symbols': [{'symbol': s, 'status': 'TRADING'} for s in market.symbols]}, used)
+            elif url.path == '/api/v3/ticker/24hr':
+                day = market.now_ms - market.now_ms % 86400000 - 86400000
+                self._send(200, [{'symbol': s, 'quoteVolume': synthetic_klines(s, np.array([day]), 86400000)[0][7]}
+                                 for s in market.symbols], used)
+            elif url.path == '/api/v3/klines':
+                symbol = params.get('symbol')
+                if symbol not in market.listed_at or params.get('interval') not in INTERVAL_MS:
+                    self._send(400, {'code': -1121, 'msg': 'Invalid symbol.'}, used)
+                    return
+                self._send(200, market.klines(symbol, params['interval'], int(params.get('startTime', 0)),
+                                              int(params.get('endTime', market.now_ms)),
+                                              min(int(params.get('limit', 500)), MAX_LIMIT)), used)
+            else:
+                self._send(404, {'code': -1, 'msg': 'not found'}, used)
+
+    return Handler
+
+
+def _serve(market, latency, ready):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(market, latency))
+    server.daemon_threads = True
+    ready.put(f'http://127.0.0.1:{server.server_address[1]}')
+    server.serve_forever()
+
+
+# serve `market` on 127.0.0.1 from a child process, returns (process, base url); process.terminate() stops it
+def start_server(market, latency=DEFAULT_LATENCY):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(market, latency, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
@@ -1,10 +1,25 @@
+import json
 import logging
 import pymysql
+import numpy as np
 import pandas as pd
 import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-import requests
+
+# shared modules live next to the collector
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '1 Binance_Spot_Market_Data', '1 Daily_Data_'))
+from dbutils.pooled_db import PooledDB
+from kline_cache import KlineCache
+from binance_klines_fetcher import fetch_klines, limiter, SYMBOL_WORKERS, PAGE_WORKERS
+from database_reader import stream_dataframe, split_by_symbol
+from kline_digest import (compute_month_digests, mismatching_months, month_blocks, month_of, month_range,
+                          get_stored_month_digests)
+from reconciliation import reconcile, merge_for_reconcile, mismatch_ranges
+from metrics import metrics, configure_from_env
 
 
 logging.basicConfig(
@@ -21,7 +36,16 @@ AWS_RDS_PASSWORD = os.getenv('***')
 AWS_RDS_DATABASE = os.getenv('***')
 
 
-BINANCE_KLINES_URL = "https://api.binance.com/api/v3/klines"
+
+# the same on-disk kline cache the collector fills
+kline_cache = KlineCache()
+
+
+# symbols verified at the same time, bounded by the pool's 8 connections; the Binance side is
+# throttled by the fetcher's shared limiter, which follows X-MBX-USED-WEIGHT-1M. PAGE_WORKERS page
+# requests per symbol are in flight, the fetcher's connection pool is sized for both
+CHECK_CONCURRENCY = SYMBOL_WORKERS
+CHECK_REPORT_FILE = 'check_report.json'
 
 
 TOLERANCE_DICT = {
@@ -32,21 +56,38 @@ TOLERANCE_DICT = {
 }
 
 
+KLINE_COLUMNS = {
+    'timestamp': 'int64',
+    'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64',
+    'volume': 'float64', 'quote_volume': 'float64', 'trades': 'int64'
+}
+
+
+# one pool for the whole run instead of a new connection (and TLS handshake) per query
+pool = PooledDB(
+    creator=pymysql,
+    maxconnections=8,
+    mincached=2,
+    maxcached=4,
+    blocking=True,
+    host=AWS_RDS_HOST,
+    user=AWS_RDS_USER,
+    password=AWS_RDS_PASSWORD,
+    database=AWS_RDS_DATABASE,
+    charset='utf8',
+    autocommit=True
+)
+
+
 def connect_database():
     try:
-        return pymysql.connect(
-            host=AWS_RDS_HOST,
-            user=AWS_RDS_USER,
-            password=AWS_RDS_PASSWORD,
-            database=AWS_RDS_DATABASE,
-            charset='utf8',
-            autocommit=True
-        )
+        return pool.connection()
     except Exception as e:
         logging.error(f"❌ fail to connect database: {e}")
         return None
 
 
+# {symbol: (start_ts, end_ts, rows)}, the row count lets the readers preallocate exactly
 def get_symbols_time_range():
     connection = connect_database()
     if not connection:
@@ -55,7 +96,7 @@ def get_symbols_time_range():
     try:
         with connection.cursor() as cursor:
             cursor.execute("""
-                SELECT symbol, MIN(timestamp) AS start_ts, MAX(timestamp) AS end_ts
+                SELECT symbol, MIN(timestamp) AS start_ts, MAX(timestamp) AS end_ts, COUNT(*) AS row_count
                 FROM ***
                 GROUP BY symbol
             """)
@@ -66,87 +107,67 @@ def get_symbols_time_range():
     finally:
         connection.close()
 
-    return {row[0]: (row[1], row[2]) for row in data}
+    return {row[0]: (row[1], row[2], row[3]) for row in data}
 
 
-def get_data_from_database(symbol, start_ts, end_ts):
+def get_data_from_database(symbol, start_ts, end_ts, expected_rows=0):
     connection = connect_database()
     if not connection:
         return pd.DataFrame()
 
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
+        with metrics.timer('db_read_seconds', symbol):
+            return stream_dataframe(connection, """
                 SELECT timestamp, open, high, low, close, volume, quote_volume, trades
                 FROM ***
                 WHERE symbol = %s AND timestamp BETWEEN %s AND %s
                 ORDER BY timestamp ASC
-            """, (symbol, start_ts, end_ts))
-            data = cursor.fetchall()
+            """, (symbol, start_ts, end_ts), KLINE_COLUMNS, expected_rows)
     except Exception as e:
         logging.error(f"❌ get {symbol} failed : {e}")
         return pd.DataFrame()
     finally:
         connection.close()
 
-    if not data:
-        return pd.DataFrame()
-
-    df = pd.DataFrame(data, columns=[
-        'timestamp', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trades'
-    ])
 
+# every symbol in one ordered, streamed query, split into {symbol: frame} in memory
+def get_all_data_from_database(expected_rows=0):
+    connection = connect_database()
+    if not connection:
+        return {}
 
-    df = df.astype({
-        'timestamp': 'int',
-        'open': 'float', 'high': 'float', 'low': 'float', 'close': 'float',
-        'volume': 'float', 'quote_volume': 'float', 'trades': 'int'
-    })
+    try:
+        df = stream_dataframe(connection, """
+            SELECT symbol, timestamp, open, high, low, close, volume, quote_volume, trades
+            FROM ***
+            ORDER BY symbol, timestamp ASC
+        """, None, {'symbol': 'object', **KLINE_COLUMNS}, expected_rows)
+    except Exception as e:
+        logging.error(f"❌ fail to read data from database: {e}")
+        return {}
+    finally:
+        connection.close()
 
-    return df
+    return split_by_symbol(df)
 
 
+# the full [start_ts, end_ts] range with the collector's paging: cached bars are read from disk,
+# missing ranges are fetched page by page in parallel through the shared rate limiter
 def get_binance_API_data(symbol, start_ts, end_ts):
-    params = {
-        'symbol': symbol,
-        'interval': '1d',
-        'startTime': start_ts,
-        'endTime': end_ts,
-        'limit': 1000
-    }
-
-    try:
-        response = requests.get(BINANCE_KLINES_URL, params=params, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        logging.error(f"⚠️ Binance API failed to get : {symbol} | {e}")
-        return None
-
-    data = response.json()
-    if not isinstance(data, list) or len(data) == 0:
+    df = fetch_klines(symbol, start_ts, '1d', end=end_ts, max_workers=PAGE_WORKERS, cache=kline_cache)
+    if df is None or df.empty:
         logging.warning(f"⚠️ Binance API return empty data: {symbol}")
         return None
+    return df[['timestamp', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trades']]
 
-    df = pd.DataFrame(data, columns=[
-        'timestamp', 'open', 'high', 'low', 'close', 'volume',
-        'close_time', 'quote_volume', 'trades',
-        'takerBuyBaseAssetVolume', 'takerBuyQuoteAssetVolume', 'ignore'
-    ])
-    df.drop(columns=['close_time', 'ignore', 'takerBuyBaseAssetVolume', 'takerBuyQuoteAssetVolume'], inplace=True)
-    df = df.astype({
-        'timestamp': 'int',
-        'open': 'float', 'high': 'float', 'low': 'float', 'close': 'float',
-        'volume': 'float', 'quote_volume': 'float', 'trades': 'int'
-    })
-
-    return df
 
-
-def check_symbols(symbol, start_ts, end_ts):
+# database_data can be passed in when all symbols were loaded at once
+def check_symbols(symbol, start_ts, end_ts, database_data=None, expected_rows=0):
     logging.info(f'🔍 checking {symbol} data')
 
 
-    database_data = get_data_from_database(symbol, start_ts, end_ts)
+    if database_data is None:
+        database_data = get_data_from_database(symbol, start_ts, end_ts, expected_rows)
     if database_data.empty:
         logging.warning(f'⚠️  {symbol} does not in database')
         return
@@ -159,36 +180,183 @@ def check_symbols(symbol, start_ts, end_ts):
     else:
         logging.info(f'✅ {symbol} Binance get data successfully')
 
-    merged = database_data.merge(binance_data, on='timestamp', suffixes=('_db', '_api'))
+    merged = merge_for_reconcile(database_data, binance_data)
     if merged.empty:
         logging.error(f'❌ {symbol} can not match timestamp and they can not be combained')
         return
 
     logging.info(f'✅ {symbol} timestamp matched successfully and beginning check data')
 
+    report = compare_rows(symbol, merged, database_data, binance_data)
+    log_report(symbol, report)
+    return report
 
-    all_good = True
-    for col, tolerance in TOLERANCE_DICT.items():
-        merged[f'{col}_diff'] = (merged[f"{col}_db"] - merged[f"{col}_api"]).abs()
-        merged[f'{col}_error_rate'] = merged.apply(
-            lambda row: (row[f'{col}_diff'] / row[f'{col}_api']) * 100 if row[f'{col}_api'] != 0 else 0, axis=1
-        )
 
-        inconsistent_rows = merged[merged[f'{col}_error_rate'] > tolerance]
-        if not inconsistent_rows.empty:
-            logging.warning(f'⚠️ {symbol}: {col} the error is too big, and the number of error data is {len(inconsistent_rows)}')
-            all_good = False
+# row-level report of a merged frame, with how much of the stored history was really compared;
+# missing_ranges are the runs of reference bars that are not stored, gap repair fetches exactly those
+def compare_rows(symbol, merged, database_data, binance_data):
+    if merged.empty:
+        report = {
+            'rows_checked': 0,
+            'mismatches': {col: 0 for col in TOLERANCE_DICT},
+            'max_error_rate': {col: 0.0 for col in TOLERANCE_DICT},
+            'worst_rows': [],
+            'mismatch_ranges': [],
+        }
+    else:
+        report = reconcile(merged, TOLERANCE_DICT, symbol)[symbol]
+    not_stored = ~binance_data['timestamp'].isin(database_data['timestamp']).to_numpy()
+    report['coverage'] = {
+        'stored': len(database_data),
+        'reference': len(binance_data),
+        'checked': len(merged),
+        'missing_in_database': int(not_stored.sum()),
+        'missing_in_binance': int((~database_data['timestamp'].isin(binance_data['timestamp'])).sum()),
+        'missing_ranges': mismatch_ranges(np.full(len(binance_data), symbol), binance_data['timestamp'].to_numpy(),
+                                          not_stored).get(symbol, []),
+    }
+    return report
+
+
+def get_stored_digests(symbol):
+    connection = connect_database()
+    if not connection:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            return get_stored_month_digests(cursor, symbol)
+    except Exception as e:
+        logging.error(f"❌ get {symbol} month digests failed : {e}")
+        return None
+    finally:
+        connection.close()
+
 
+# compare the stored month digests with digests of the reference klines and only read and
+# reconcile the stored rows of the months that differ; months without a stored digest (written
+# before the digests existed) always differ, so they get the full row check
+def check_symbols_by_digest(symbol, start_ts, end_ts, expected_rows=0):
+    logging.info(f'🔍 checking {symbol} data by month digest')
+
+    stored_digests = get_stored_digests(symbol)
+    if stored_digests is None:
+        return check_symbols(symbol, start_ts, end_ts, expected_rows=expected_rows)
+
+    binance_data = get_binance_API_data(symbol, start_ts, end_ts)
+    if binance_data is None or binance_data.empty:
+        logging.warning(f'⚠️ Binance return {symbol} data none')
+        return
+
+    reference_digests = compute_month_digests(binance_data, TOLERANCE_DICT)
+    months = mismatching_months(stored_digests, reference_digests)
+    logging.info(f'✅ {symbol} {len(reference_digests) - len(months)} months match by digest, '
+                 f'{len(months)} months to check row by row')
+
+    database_parts = []
+    for first_month, last_month in month_blocks(months):
+        block_start = max(month_range(first_month)[0], start_ts)
+        block_end = min(month_range(last_month)[1], end_ts)
+        database_parts.append(get_data_from_database(symbol, block_start, block_end))
+    database_data = pd.concat(database_parts, ignore_index=True) if database_parts else \
+        pd.DataFrame({column: np.empty(0, dtype=dtype) for column, dtype in KLINE_COLUMNS.items()})
+    binance_data = binance_data[np.isin(month_of(binance_data['timestamp']), months)]
+
+    report = compare_rows(symbol, merge_for_reconcile(database_data, binance_data), database_data, binance_data)
+    # rows of the matching months count as checked: their digests agree within tolerance
+    matched_rows = int(stored_digests.loc[~stored_digests['month'].isin(months), 'row_count'].sum())
+    report['coverage']['stored'] += matched_rows
+    report['coverage']['checked'] += matched_rows
+    report['digest'] = {
+        'months': len(reference_digests),
+        'months_mismatched': len(months),
+        'mismatching_months': months,
+    }
+    log_report(symbol, report)
+    return report
+
+
+def log_report(symbol, report):
+    coverage = report['coverage']
+    logging.info(f'📊 {symbol} checked {coverage["checked"]} of {coverage["stored"]} stored bars '
+                 f'({coverage["missing_in_binance"]} not on Binance, {coverage["missing_in_database"]} not stored)')
+    all_good = coverage['missing_in_binance'] == 0 and coverage['missing_in_database'] == 0
+    for col, count in report['mismatches'].items():
+        if count:
+            logging.warning(f'⚠️ {symbol}: {col} the error is too big, and the number of error data is {count}'
+                            f' (max error rate {report["max_error_rate"][col]:.4f}%)')
+            all_good = False
+    for row in report['worst_rows']:
+        logging.warning(f'⚠️ {symbol}: {row["column"]} at {row["timestamp"]} db={row["db"]} api={row["api"]}'
+                        f' error rate {row["error_rate"]:.4f}%')
 
     if all_good:
         logging.info(f'✅ {symbol} all data are checked well')
 
 
-if __name__ == "__main__":
-    symbols_time_range = get_symbols_time_range()
-
+# run check_symbols (or check_symbols_by_digest) for every symbol on a worker pool and aggregate one summary report
+def check_all_symbols(symbols_time_range, all_data=None, concurrency=CHECK_CONCURRENCY, by_digest=False):
+    started = time.time()
+    reports = {}
+    failed = []
+
+    def check(symbol, start_ts, end_ts, row_count):
+        with metrics.symbol(symbol), metrics.timer('check_seconds', mode='digest' if by_digest else 'rows'):
+            if by_digest:
+                report = check_symbols_by_digest(symbol, start_ts, end_ts, row_count)
+            else:
+                database_data = all_data.get(symbol, pd.DataFrame()) if all_data is not None else None
+                report = check_symbols(symbol, start_ts, end_ts, database_data, row_count)
+        if report is not None:
+            metrics.count('rows_checked_total', report['coverage']['checked'])
+        return report
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(check, symbol, start_ts, end_ts, row_count): symbol
+                   for symbol, (start_ts, end_ts, row_count) in symbols_time_range.items()}
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                logging.error(f'❌ {symbol} check failed : {e}')
+                report = None
+            if report is None:
+                failed.append(symbol)
+            else:
+                reports[symbol] = report
+
+    mismatching = sorted(symbol for symbol, report in reports.items() if any(report['mismatches'].values()))
+    summary = {
+        'symbols': len(symbols_time_range),
+        'checked': len(reports),
+        'failed': sorted(failed),
+        'mismatching': mismatching,
+        'bars_checked': sum(report['coverage']['checked'] for report in reports.values()),
+        'bars_stored': sum(report['coverage']['stored'] for report in reports.values()),
+        'elapsed_seconds': round(time.time() - started, 3),
+        'peak_used_weight': limiter.peak_used_weight,
+        'rate_limit_waits': limiter.wait_count,
+        'reports': reports,
+    }
+    logging.info(f'📋 {summary["checked"]} of {summary["symbols"]} symbols checked in {summary["elapsed_seconds"]}s, '
+                 f'{summary["bars_checked"]} of {summary["bars_stored"]} stored bars verified, '
+                 f'{len(mismatching)} with mismatches: {mismatching}, failed: {summary["failed"]}')
+    return summary
 
-    for symbol, (start_ts, end_ts) in symbols_time_range.items():
-        check_symbols(symbol, start_ts, end_ts)
-        time.sleep(0.2)
 
+if __name__ == "__main__":
+    # load the whole table with one streamed query instead of one query per symbol
+    load_all_at_once = False
+    # compare month digests first and only drill into the months that differ
+    by_digest = True
+    configure_from_env()
+    symbols_time_range = get_symbols_time_range()
+    all_data = None
+    if load_all_at_once and not by_digest:
+        all_data = get_all_data_from_database(sum(row_count for _, _, row_count in symbols_time_range.values()))
+
+    summary = check_all_symbols(symbols_time_range, all_data, by_digest=by_digest)
+    metrics.flush('checker')
+    with open(CHECK_REPORT_FILE, 'w') as f:
+        json.dump(summary, f, indent=2, default=lambda value: value.item())
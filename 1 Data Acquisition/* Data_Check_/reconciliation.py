@@ -0,0 +1,90 @@
+# vectorized reconciliation of stored klines against Binance klines
+# works on the merge of one symbol or on a concatenated multi-symbol frame (with a `symbol` column)
+
+import numpy as np
+import pandas as pd
+
+
+
+WORST_ROWS = 5
+
+
+
+# error rate in percent for every tolerance column at once, 0 where the API value is 0
+def compute_error_rates(merged, columns):
+    database_values = merged[[f'{col}_db' for col in columns]].to_numpy(dtype=float)
+    api_values = merged[[f'{col}_api' for col in columns]].to_numpy(dtype=float)
+    error_rates = np.zeros_like(api_values)
+    np.divide(np.abs(database_values - api_values), api_values, out=error_rates, where=api_values != 0)
+    return error_rates * 100
+
+
+# [start_ts, end_ts] of every run of adjacent flagged rows (a value over tolerance, a bar not stored), per symbol
+def mismatch_ranges(symbols, timestamps, flagged):
+    rows = pd.DataFrame({'symbol': symbols, 'timestamp': timestamps, 'flagged': flagged})
+    rows = rows.sort_values(['symbol', 'timestamp'], kind='stable')
+    symbols, timestamps, flagged = rows['symbol'].to_numpy(), rows['timestamp'].to_numpy(), rows['flagged'].to_numpy()
+    continues = np.zeros(len(flagged), dtype=bool)
+    continues[1:] = flagged[:-1] & (symbols[1:] == symbols[:-1])
+    runs = pd.DataFrame({
+        'symbol': symbols[flagged],
+        'run': np.cumsum(flagged & ~continues)[flagged],
+        'timestamp': timestamps[flagged],
+    }).groupby(['symbol', 'run'], sort=False)['timestamp'].agg(['min', 'max'])
+    ranges = {}
+    for (s, _), (start, end) in zip(runs.index, runs.to_numpy()):
+        ranges.setdefault(s, []).append([int(start), int(end)])
+    return ranges
+
+
+# {symbol: {'rows_checked', 'mismatches', 'max_error_rate', 'worst_rows', 'mismatch_ranges'}} for
+# every symbol in `merged`; worst_rows are the top `worst_rows` only, mismatch_ranges cover every
+# mismatching row
+def reconcile(merged, tolerance_dict, symbol=None, worst_rows=WORST_ROWS):
+    columns = list(tolerance_dict)
+    tolerances = np.array([tolerance_dict[col] for col in columns], dtype=float)
+    symbols = merged['symbol'].to_numpy() if 'symbol' in merged else np.full(len(merged), symbol, dtype=object)
+
+    error_rates = compute_error_rates(merged, columns)
+    inconsistent = error_rates > tolerances
+
+    rates = pd.DataFrame(error_rates, columns=columns)
+    rates['symbol'] = symbols
+    flags = pd.DataFrame(inconsistent, columns=columns)
+    flags['symbol'] = symbols
+    rows_checked = rates.groupby('symbol', sort=False).size()
+    max_error_rate = rates.groupby('symbol', sort=False).max()
+    mismatches = flags.groupby('symbol', sort=False).sum()
+
+    # one entry per (row, column) over tolerance, ranked by how far past its tolerance it is
+    row_index, column_index = np.nonzero(inconsistent)
+    worst = pd.DataFrame({
+        'symbol': symbols[row_index],
+        'timestamp': merged['timestamp'].to_numpy()[row_index],
+        'column': np.array(columns, dtype=object)[column_index],
+        'db': merged[[f'{col}_db' for col in columns]].to_numpy(dtype=float)[row_index, column_index],
+        'api': merged[[f'{col}_api' for col in columns]].to_numpy(dtype=float)[row_index, column_index],
+        'error_rate': error_rates[row_index, column_index],
+        'excess': error_rates[row_index, column_index] / tolerances[column_index],
+    })
+    worst = worst.sort_values('excess', ascending=False).groupby('symbol', sort=False).head(worst_rows)
+    worst_by_symbol = {s: rows.drop(columns=['symbol', 'excess']).to_dict('records')
+                       for s, rows in worst.groupby('symbol', sort=False)}
+    ranges = mismatch_ranges(symbols, merged['timestamp'].to_numpy(), inconsistent.any(axis=1))
+
+    report = {}
+    for s in rows_checked.index:
+        report[s] = {
+            'rows_checked': int(rows_checked[s]),
+            'mismatches': {col: int(mismatches.at[s, col]) for col in columns},
+            'max_error_rate': {col: float(max_error_rate.at[s, col]) for col in columns},
+            'worst_rows': worst_by_symbol.get(s, []),
+            'mismatch_ranges': ranges.get(s, []),
+        }
+    return report
+
+
+# merge stored and API frames on timestamp (and symbol when both frames carry several symbols)
+def merge_for_reconcile(database_data, binance_data):
+    keys = ['symbol', 'timestamp'] if 'symbol' in database_data and 'symbol' in binance_data else ['timestamp']
+    return database_data.merge(binance_data, on=keys, suffixes=('_db', '_api'))
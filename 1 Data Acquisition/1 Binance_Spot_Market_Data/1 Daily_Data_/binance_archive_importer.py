@@ -0,0 +1,163 @@
+# bulk backfill from binance's public kline archives (data.binance.vision)
+#
+# the monthly/daily zips ({SYMBOL}-{interval}-{YYYY-MM[-DD]}.zip, any directory layout below
+# ARCHIVE_DIR) are read straight from the zip, CSV member by member, into the same typed columns
+# the REST fetcher decodes into; nothing is extracted to disk. When a {zip}.CHECKSUM file is next
+# to an archive its sha256 is verified first and a mismatching archive is skipped (the hole it
+# leaves is found by binance_spot_gap_repair). Only the bars after the last archived one (the
+# running month) come from the REST API.
+# the symbols then go through the collector's indicator and store stages: 1d archives like
+# collect_pipelined, 1m archives like collect_intraday (every resampled intraday interval to its own
+# table, the daily table is only written from 1d archives), in IMPORT_BATCH_SIZE upserts or with LOAD DATA
+
+import hashlib
+import logging
+import os
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from binance_spot_historical_day_data import (get_binance_server_time, save_data_into_database, kline_cache,
+                                              FETCH_WORKERS, FETCH_PAGE_WORKERS, COMPUTE_WORKERS, STORE_WORKERS)
+from binance_klines_fetcher import fetch_klines, INTERVAL_MS
+from kline_decoder import KlineColumns, KLINE_FIELDS, FLOAT_FIELDS
+from kline_resampler import SOURCE_INTERVAL, calculate_interval_indicators
+from indicator_registry import compute_symbol_indicators
+from metrics import metrics
+from pipeline import QUEUE_SIZE, Stage, run_pipeline
+
+
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'binance_archives'))
+# archives without a .CHECKSUM file are imported unless this is set
+REQUIRE_CHECKSUM = os.getenv('REQUIRE_CHECKSUM', '0') == '1'
+# rows per upsert statement, a backfill writes whole histories at once
+IMPORT_BATCH_SIZE = 5000
+# LOAD DATA LOCAL INFILE instead of upserts, needs local_infile on the server
+IMPORT_USE_LOAD_DATA = os.getenv('IMPORT_USE_LOAD_DATA', '0') == '1'
+# binance writes spot open times in microseconds from 2025 on, anything above this is not ms
+MICROSECOND_TIMESTAMPS = 10 ** 14
+HASH_CHUNK_BYTES = 1 << 20
+
+ARCHIVE_NAME = re.compile(r'^([A-Z0-9]+)-(\w+)-(\d{4}-\d{2}(?:-\d{2})?)\.zip$')
+# CSV positions of the kept fields, the same as in a REST kline row
+ARCHIVE_DTYPES = {KLINE_FIELDS['timestamp']: 'int64', KLINE_FIELDS['trades']: 'int64',
+                  **{KLINE_FIELDS[field]: 'float64' for field in FLOAT_FIELDS}}
+
+
+
+# {symbol: [archive paths]} for one interval, monthly archives before the daily ones of the same month
+def find_archives(directory=ARCHIVE_DIR, interval='1d', symbols=None):
+    archives = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            match = ARCHIVE_NAME.match(name)
+            if not match or match.group(2) != interval:
+                continue
+            symbol, period = match.group(1), match.group(3)
+            if symbols is None or symbol in symbols:
+                archives.setdefault(symbol, []).append((period, os.path.join(root, name)))
+    return {symbol: [path for _, path in sorted(paths)] for symbol, paths in archives.items()}
+
+
+# True/False when a .CHECKSUM file is there, None when it is not
+def verify_checksum(path):
+    checksum_path = path + '.CHECKSUM'
+    if not os.path.exists(checksum_path):
+        return None
+    with open(checksum_path) as f:
+        expected = f.read().split()[0].lower()
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+
+# every CSV member of one archive into `columns`, returns the rows added
+def read_archive(path, columns):
+    rows = 0
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.namelist():
+            if not member.endswith('.csv'):
+                continue
+            with archive.open(member) as stream:
+                # the newer archives start with a header line
+                header = not stream.peek(1)[:1].isdigit()
+                df = pd.read_csv(stream, header=None, skiprows=int(header), usecols=list(ARCHIVE_DTYPES),
+                                 dtype=ARCHIVE_DTYPES)
+            timestamp = df[KLINE_FIELDS['timestamp']].to_numpy()
+            if len(timestamp) and timestamp.max() >= MICROSECOND_TIMESTAMPS:
+                timestamp = timestamp // 1000
+            floats = np.vstack([df[KLINE_FIELDS[field]].to_numpy() for field in FLOAT_FIELDS])
+            columns.append_arrays(timestamp, floats, df[KLINE_FIELDS['trades']].to_numpy())
+            rows += len(df)
+    return rows
+
+
+# one symbol's archives plus the REST tail after them, the signature of a pipeline stage
+def read_archives_stage(symbol, payload):
+    paths, interval, end_time = payload
+    columns = KlineColumns()
+    files = 0
+    with metrics.timer('archive_read_seconds', interval=interval):
+        for path in paths:
+            verified = verify_checksum(path)
+            if verified is False or (verified is None and REQUIRE_CHECKSUM):
+                logging.error(f"❌ {symbol} {os.path.basename(path)} "
+                              f"{'checksum mismatch' if verified is False else 'has no checksum'}, skipped")
+                metrics.count('archive_files_total', status='rejected')
+                continue
+            try:
+                read_archive(path, columns)
+            except (zipfile.BadZipFile, ValueError, KeyError) as e:
+                logging.error(f"❌ {symbol} {os.path.basename(path)} unreadable : {e}")
+                metrics.count('archive_files_total', status='unreadable')
+                continue
+            metrics.count('archive_files_total', status='ok')
+            files += 1
+    if not columns.size:
+        return None
+    archived = columns.to_dataframe()
+    metrics.count('archive_rows_total', len(archived), interval=interval)
+
+    tail_start = int(archived['timestamp'].iat[-1]) + INTERVAL_MS[interval]
+    tail = fetch_klines(symbol, tail_start, interval, end=end_time, max_workers=FETCH_PAGE_WORKERS, cache=kline_cache)
+    if tail is not None and not tail.empty:
+        archived = pd.concat([archived, tail], ignore_index=True)
+    logging.info(f"✅ {symbol} {len(archived)} {interval} bars from {files} archives, "
+                 f"{0 if tail is None else len(tail)} from the API")
+    return archived
+
+
+# 1d frames go to the daily table, 1m results ({interval: frame}, no 1d) to every interval's table
+def store_import_stage(symbol, result):
+    frames = result if isinstance(result, dict) else {'1d': result}
+    for interval, df in frames.items():
+        save_data_into_database(df, symbol, IMPORT_BATCH_SIZE, use_load_data=IMPORT_USE_LOAD_DATA, interval=interval)
+    return True
+
+
+# backfill every symbol with archives of `interval` ('1d', or '1m' with the resampled intraday intervals)
+def import_archives(directory=ARCHIVE_DIR, interval='1d', symbols=None):
+    if interval not in ('1d', SOURCE_INTERVAL):
+        raise ValueError(f"archives of {interval} are not imported, use 1d or {SOURCE_INTERVAL}")
+    archives = find_archives(directory, interval, symbols)
+    if not archives:
+        logging.warning(f"⚠️ no {interval} archives under {directory}")
+        return None
+    logging.info(f"📦 importing {sum(len(p) for p in archives.values())} {interval} archives of {len(archives)} symbols")
+    end_time = get_binance_server_time()
+    indicators = compute_symbol_indicators if interval == '1d' else calculate_interval_indicators
+    return run_pipeline({symbol: (paths, interval, end_time) for symbol, paths in archives.items()}, [
+        Stage('read', read_archives_stage, FETCH_WORKERS),
+        Stage('indicators', indicators, COMPUTE_WORKERS, processes=True),
+        Stage('store', store_import_stage, STORE_WORKERS),
+    # years of 1m bars per symbol are large, only a few wait in each queue
+    ], queue_size=COMPUTE_WORKERS if interval == SOURCE_INTERVAL else QUEUE_SIZE)
+
+
+if __name__ == '__main__':
+    import_archives()
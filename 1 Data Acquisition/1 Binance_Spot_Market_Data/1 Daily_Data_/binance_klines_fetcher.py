@@ -0,0 +1,317 @@
+# concurrent binance klines fetcher with a shared, weight-aware rate limiter
+
+import logging
+import numbers
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from kline_decoder import KlineColumns, decode_json
+from metrics import metrics
+
+
+
+# binance API
+BINANCE_KLINES_URL = 'https://api.binance.com/api/v3/klines'
+BINANCE_TIME_URL = 'https://api.binance.com/api/v3/time'
+BINANCE_TICKER_24H_URL = 'https://api.binance.com/api/v3/ticker/24hr'
+API_TIMEOUT = 5
+
+# binance counts request weight per IP in fixed 1 minute windows, the hard limit is 1200,
+# keep the same safety margin get_historical_klines used before
+WEIGHT_BUDGET_1M = 1100
+WEIGHT_WINDOW_SECONDS = 60
+# start a new window slightly late so a small clock offset never lands us in the old one
+WINDOW_MARGIN_SECONDS = 0.5
+KLINES_WEIGHT = 2
+TIME_WEIGHT = 1
+# /ticker/24hr without a symbol returns every symbol at once
+TICKER_24H_ALL_WEIGHT = 80
+KLINES_LIMIT = 1000
+MAX_THROTTLE_RETRIES = 3
+MAX_WORKERS = 8
+# symbols fetched at once by the collector's pipeline and the checker, each with PAGE_WORKERS pages in flight
+SYMBOL_WORKERS = 8
+PAGE_WORKERS = 2
+# one keep-alive connection per request that can be in flight: those, plus a fetch_klines_many of
+# MAX_WORKERS running alongside (the background universe refresh)
+HTTP_POOL_SIZE = SYMBOL_WORKERS * PAGE_WORKERS + MAX_WORKERS
+# a bar counts as closed for the cache only this long after its period ended
+CLOSE_MARGIN_MS = 60000
+# the measured offset between binance's clock and ours is reused this long
+SERVER_TIME_TTL_SECONDS = 600
+
+INTERVAL_MS = {
+    '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000,
+    '30m': 1800000, '1h': 3600000, '2h': 7200000, '4h': 14400000,
+    '6h': 21600000, '8h': 28800000, '12h': 43200000, '1d': 86400000
+}
+
+
+
+# retry API connection, the pool is sized so every request in flight keeps its own keep-alive connection
+session = requests.Session()
+retry = Retry(
+    total=3,
+    backoff_factor=2,
+    status_forcelist=[500, 502, 503, 504]
+)
+session.mount('https://', HTTPAdapter(max_retries=retry, pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+
+
+
+# token bucket shared by every thread, it refills at binance's minute boundary and is corrected
+# by the real X-MBX-USED-WEIGHT-1M header so other clients on the same IP are accounted for
+class WeightRateLimiter:
+
+    def __init__(self, budget=WEIGHT_BUDGET_1M, window_seconds=WEIGHT_WINDOW_SECONDS):
+        self.budget = budget
+        self.window_seconds = window_seconds
+        self._condition = threading.Condition()
+        self._window_start = self._current_window()
+        self._used = 0
+        self._blocked_until = 0.0
+        self.peak_used_weight = 0
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+
+    def _current_window(self):
+        now = time.time() - WINDOW_MARGIN_SECONDS
+        return now - now % self.window_seconds
+
+    def _roll_window(self):
+        window_start = self._current_window()
+        if window_start > self._window_start:
+            self._window_start = window_start
+            self._used = 0
+
+    # block until `weight` fits into the current window, then reserve it
+    def acquire(self, weight=1):
+        waited = False
+        wait_start = time.time()
+        with self._condition:
+            while True:
+                now = time.time()
+                self._roll_window()
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self._used + weight <= self.budget:
+                    self._used += weight
+                    break
+                else:
+                    delay = self._window_start + self.window_seconds + WINDOW_MARGIN_SECONDS - now
+                self._condition.wait(delay)
+                waited = True
+            if waited:
+                waited = time.time() - wait_start
+                self.wait_count += 1
+                self.wait_seconds += waited
+                metrics.count('rate_limit_waits_total')
+                metrics.count('rate_limit_wait_seconds_total', waited)
+        if waited and waited > 1:
+            logging.warning(f"⏸️ API weight budget reached, waited {waited:.1f} seconds")
+
+    # sync the local estimate with what binance reports after every response
+    def update(self, response):
+        used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M')
+        with self._condition:
+            self._roll_window()
+            if used_weight is not None:
+                used_weight = int(used_weight)
+                self._used = max(self._used, used_weight)
+                self.peak_used_weight = max(self.peak_used_weight, used_weight)
+                metrics.set_max('used_weight_peak', used_weight)
+            if response.status_code in (418, 429):
+                retry_after = int(response.headers.get('Retry-After', self.window_seconds))
+                self._blocked_until = max(self._blocked_until, time.time() + retry_after)
+                metrics.count('rate_limit_responses_total', status=response.status_code)
+                logging.warning(f"⏸️ API limitation ({response.status_code}), stop for {retry_after} seconds")
+            self._condition.notify_all()
+
+
+# one limiter per process, every fetch shares it unless told otherwise
+limiter = WeightRateLimiter()
+
+
+
+# epoch ms, date strings and naive datetimes are UTC, aware datetimes (get_binance_server_time) keep their zone
+def to_milliseconds(value):
+    if isinstance(value, numbers.Real):
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return int(timestamp.timestamp() * 1000)
+
+
+# send one weighted GET through the limiter, retrying when binance throttles us.
+# the request time (without the limiter wait) goes to the http_request_seconds histogram
+def limited_get(url, params, weight, limiter=limiter, session=session, symbol=None):
+    endpoint = url.rsplit('/', 1)[-1]
+    for _ in range(MAX_THROTTLE_RETRIES + 1):
+        limiter.acquire(weight)
+        with metrics.timer('http_request_seconds', symbol, endpoint=endpoint):
+            response = session.get(url, params=params, timeout=API_TIMEOUT)
+        metrics.count('http_requests_total', endpoint=endpoint, status=response.status_code)
+        limiter.update(response)
+        if response.status_code not in (418, 429):
+            response.raise_for_status()
+            return response
+    response.raise_for_status()
+
+
+def get_server_time_ms(limiter=limiter, session=session):
+    response = limited_get(BINANCE_TIME_URL, None, TIME_WEIGHT, limiter, session)
+    return int(response.json()['serverTime'])
+
+
+# binance time from the local clock plus a cached offset, /time is asked again after the TTL
+class ServerClock:
+
+    def __init__(self, ttl_seconds=SERVER_TIME_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._offset_ms = None
+        self._synced_at = 0.0
+
+    def sync(self, limiter=limiter, session=session):
+        sent = time.time()
+        server_ms = get_server_time_ms(limiter, session)
+        received = time.time()
+        # assume the server read its clock half way through the round trip
+        with self._lock:
+            self._offset_ms = server_ms - (sent + received) / 2 * 1000
+            self._synced_at = received
+
+    def now_ms(self, limiter=limiter, session=session):
+        if self._offset_ms is None or time.time() - self._synced_at > self.ttl_seconds:
+            self.sync(limiter, session)
+        return int(time.time() * 1000 + self._offset_ms)
+
+
+server_clock = ServerClock()
+
+
+# {symbol: 24h quote volume} for every symbol with one request
+def get_24h_quote_volumes(limiter=limiter, session=session):
+    tickers = decode_json(limited_get(BINANCE_TICKER_24H_URL, None, TICKER_24H_ALL_WEIGHT, limiter, session).content)
+    return {ticker['symbol']: float(ticker['quoteVolume']) for ticker in tickers}
+
+
+def fetch_klines_page(symbol, interval, start_ms, end_ms, limiter=limiter, session=session):
+    params = {
+        'symbol': symbol,
+        'interval': interval,
+        'startTime': start_ms,
+        'endTime': end_ms,
+        'limit': KLINES_LIMIT
+    }
+    data = decode_json(limited_get(BINANCE_KLINES_URL, params, KLINES_WEIGHT, limiter, session, symbol).content)
+    if not isinstance(data, list):
+        raise ValueError(f"unexpected klines payload : {data}")
+    return data
+
+
+# fetch many symbols at once, the first page of a range tells us where the history really starts,
+# the remaining pages are then planned with fixed [startTime, endTime] ranges and fetched in parallel.
+# with a KlineCache only the ranges the cache does not cover are requested, closed bars are written back
+def fetch_klines_many(symbols, start, interval='1d', end=None, max_workers=MAX_WORKERS,
+                      limiter=limiter, session=session, cache=None):
+    interval_ms = INTERVAL_MS[interval]
+    page_span = interval_ms * KLINES_LIMIT
+    # `start` is either one date for every symbol or a {symbol: start} mapping
+    if isinstance(start, dict):
+        start_ms = {symbol: to_milliseconds(start[symbol]) for symbol in symbols}
+    else:
+        start_ms = dict.fromkeys(symbols, to_milliseconds(start))
+    end_ms = to_milliseconds(end) if end is not None else server_clock.now_ms(limiter, session)
+
+    if cache is None:
+        ranges = {symbol: [(start_ms[symbol], end_ms)] for symbol in symbols}
+    else:
+        ranges = {symbol: cache.missing_ranges(symbol, interval, start_ms[symbol], end_ms) for symbol in symbols}
+
+    # pages are decoded into typed columns as they arrive, in whatever order that is
+    columns = {symbol: KlineColumns() for symbol in symbols}
+    page_counts = dict.fromkeys(symbols, 0)
+    failed = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # range_end is set on the first page of a range only
+        def submit(symbol, page_start, page_end, range_end):
+            future = executor.submit(fetch_klines_page, symbol, interval, page_start, page_end, limiter, session)
+            pending[future] = (symbol, range_end)
+
+        pending = {}
+        for symbol in symbols:
+            for range_start, range_end in ranges[symbol]:
+                submit(symbol, range_start, range_end, range_end)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                symbol, range_end = pending.pop(future)
+                if symbol in failed:
+                    continue
+                try:
+                    data = future.result()
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    logging.error(f"❌ {symbol} API fail to fetch : {e}")
+                    failed.add(symbol)
+                    continue
+
+                if not data:
+                    continue
+                columns[symbol].append(data)
+                page_counts[symbol] += 1
+
+                if range_end is not None and len(data) == KLINES_LIMIT:
+                    page_start = data[-1][0] + interval_ms
+                    columns[symbol].reserve((range_end - page_start) // interval_ms + 1)
+                    while page_start <= range_end:
+                        submit(symbol, page_start, min(page_start + page_span - 1, range_end), None)
+                        page_start += page_span
+
+    result = {}
+    for symbol in symbols:
+        if symbol in failed:
+            result[symbol] = None
+            continue
+        fetched = columns[symbol].to_dataframe() if columns[symbol].size else None
+
+        if cache is not None:
+            # bars whose period has not ended yet are returned but never cached
+            last_closed = int(time.time() * 1000) - CLOSE_MARGIN_MS - interval_ms
+            try:
+                for range_start, range_end in ranges[symbol]:
+                    cache.write(symbol, interval, fetched, range_start, min(range_end, last_closed), interval_ms)
+                cached = cache.read(symbol, interval, start_ms[symbol], end_ms)
+            # the covered bars were not fetched again, without them the symbol is incomplete
+            except (OSError, ValueError) as e:
+                logging.error(f"❌ {symbol} kline cache failed : {e}")
+                result[symbol] = None
+                continue
+            if not cached.empty:
+                cached['trade_date'] = pd.to_datetime(cached['timestamp'], unit='ms').dt.date
+                fetched = cached if fetched is None else pd.concat([cached, fetched], ignore_index=True)
+
+        if fetched is None or fetched.empty:
+            logging.warning(f"⚠️ {symbol} is empty or fail to fetch")
+            result[symbol] = None
+            continue
+        df = fetched.drop_duplicates(subset='timestamp', keep='last').sort_values('timestamp', ignore_index=True)
+        metrics.count('rows_fetched_total', len(df), interval=interval)
+        metrics.count('pages_fetched_total', page_counts[symbol], interval=interval)
+        logging.info(f"✅ {symbol} get {len(df)} rows data, {page_counts[symbol]} pages from the API")
+        result[symbol] = df
+    return result
+
+
+def fetch_klines(symbol, start, interval='1d', end=None, max_workers=MAX_WORKERS,
+                 limiter=limiter, session=session, cache=None):
+    return fetch_klines_many([symbol], start, interval, end, max_workers, limiter, session, cache)[symbol]
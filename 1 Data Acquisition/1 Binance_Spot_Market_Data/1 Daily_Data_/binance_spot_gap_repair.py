@@ -0,0 +1,207 @@
+# find and repair missing or bad days in the stored daily table
+#
+# gaps come from one indexed timestamp query per symbol compared with the daily grid between its
+# first and last bar, bad days from the checker's check_report.json. Only those ranges are fetched,
+# the indicators are recomputed for the repair window continuing from the stored row right before
+# it (like the incremental collection), and only rows whose hash changed are written back.
+# OBV, VWAP and max_drawdown depend on the whole history, they are recomputed server-side for the
+# rows after the window, so nothing after the window has to travel to the client
+
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from binance_spot_historical_day_data import (get_database_connected, get_warmup_rows, calculate_incremental_indicators,
+                                              save_data_into_database, kline_cache, KLINE_COLUMNS)
+from binance_klines_fetcher import fetch_klines, INTERVAL_MS
+
+
+
+DAY_MS = INTERVAL_MS['1d']
+# rows after the last repaired day that are recomputed as well: a changed bar moves EMA_200 by
+# (199/201)^n of its own change n bars later, below 1e-4 after 1000 bars
+REPAIR_TAIL_BARS = 1000
+# written by the checker into its working directory
+CHECK_REPORT_FILE = os.getenv('CHECK_REPORT_FILE', 'check_report.json')
+
+
+
+# [(start_ts, end_ts)] of missing days between the first and the last stored bar
+def find_gaps(symbol):
+    connection = get_database_connected()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT timestamp FROM *** WHERE symbol = %s ORDER BY timestamp", (symbol,))
+            timestamps = np.array([row[0] for row in cursor.fetchall()], dtype='int64')
+    finally:
+        connection.close()
+    if len(timestamps) < 2:
+        return []
+    holes = np.flatnonzero(np.diff(timestamps) > DAY_MS)
+    return [(int(timestamps[i] + DAY_MS), int(timestamps[i + 1] - DAY_MS)) for i in holes]
+
+
+# {symbol: [(start_ts, end_ts)]} of the days the checker flagged: every run of mismatching rows and
+# every run of reference bars that were not stored. In digest mode these come from the row check of
+# the differing months, so only the bad days are fetched, never whole months. Reports written before
+# mismatch_ranges existed only name their worst rows
+def get_reported_ranges(report_file=CHECK_REPORT_FILE):
+    if not os.path.exists(report_file):
+        return {}
+    with open(report_file) as f:
+        summary = json.load(f)
+    ranges = {}
+    for symbol, report in summary.get('reports', {}).items():
+        if 'mismatch_ranges' in report:
+            symbol_ranges = [(int(start), int(end)) for start, end in report['mismatch_ranges']]
+        else:
+            symbol_ranges = [(int(row['timestamp']), int(row['timestamp'])) for row in report.get('worst_rows', [])]
+        symbol_ranges += [(int(start), int(end)) for start, end in report.get('coverage', {}).get('missing_ranges', [])]
+        if symbol_ranges:
+            ranges[symbol] = symbol_ranges
+    return ranges
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + DAY_MS:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# row count and cumulative volume of the history before `timestamp`, the state the incremental
+# indicators continue from
+def get_prefix_state(symbol, timestamp):
+    connection = get_database_connected()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(volume), 0)
+                FROM ***
+                WHERE symbol = %s AND timestamp < %s
+            """, (symbol, timestamp))
+            count, cumulative_volume = cursor.fetchone()
+            cursor.execute("SELECT MAX(timestamp) FROM *** WHERE symbol = %s", (symbol,))
+            stored_end = cursor.fetchone()[0]
+    finally:
+        connection.close()
+    state = {'count': int(count), 'cumulative_volume': float(cumulative_volume)}
+    return state, int(stored_end) if stored_end is not None else None
+
+
+def get_stored_klines(symbol, start_ts, end_ts):
+    connection = get_database_connected()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {', '.join(KLINE_COLUMNS)}
+                FROM ***
+                WHERE symbol = %s AND timestamp BETWEEN %s AND %s
+                ORDER BY timestamp
+            """, (symbol, start_ts, end_ts))
+            data = cursor.fetchall()
+    finally:
+        connection.close()
+    df = pd.DataFrame(list(data), columns=KLINE_COLUMNS)
+    float_columns = ['open', 'high', 'low', 'close', 'volume', 'quote_volume']
+    df[float_columns] = df[float_columns].astype(float)
+    return df.astype({'timestamp': 'int64', 'trades': 'int64'})
+
+
+# recompute OBV, VWAP and max_drawdown for the rows after `after_ts` from the stored history with
+# window functions (MySQL 8); row_hash is cleared so the next save compares these rows again
+def update_cumulative_tail(symbol, after_ts):
+    connection = get_database_connected()
+    try:
+        with connection.cursor() as cursor:
+            updated = cursor.execute("""
+                UPDATE *** AS k
+                JOIN (
+                    SELECT timestamp,
+                           SUM(typical_price_volume) OVER w / SUM(volume) OVER w AS VWAP,
+                           SUM(direction * volume) OVER w AS OBV,
+                           close / MAX(close) OVER w - 1 AS max_drawdown
+                    FROM (
+                        SELECT timestamp, close, volume, (high + low + close) / 3 * volume AS typical_price_volume,
+                               COALESCE(SIGN(close - LAG(close) OVER (ORDER BY timestamp)), 0) AS direction
+                        FROM ***
+                        WHERE symbol = %s
+                    ) AS bars
+                    WINDOW w AS (ORDER BY timestamp)
+                ) AS cumulative ON k.timestamp = cumulative.timestamp
+                SET k.OBV = cumulative.OBV, k.VWAP = cumulative.VWAP, k.max_drawdown = cumulative.max_drawdown,
+                    k.row_hash = NULL
+                WHERE k.symbol = %s AND k.timestamp > %s
+            """, (symbol, symbol, after_ts))
+        connection.commit()
+    finally:
+        connection.close()
+    return updated
+
+
+# fetch the bad ranges, recompute [first bad day, last bad day + REPAIR_TAIL_BARS] and upsert it
+def repair_symbol(symbol, ranges):
+    ranges = merge_ranges(ranges)
+    first_bad, last_bad = ranges[0][0], ranges[-1][1]
+    state, stored_end = get_prefix_state(symbol, first_bad)
+    if stored_end is None:
+        logging.warning(f"⚠️ {symbol} is not in database, nothing to repair")
+        return 0
+    window_end = min(max(last_bad, stored_end), last_bad + REPAIR_TAIL_BARS * DAY_MS)
+
+    fetched = [fetch_klines(symbol, start, end=end, cache=kline_cache) for start, end in ranges]
+    fetched = [df for df in fetched if df is not None and not df.empty]
+    if not fetched:
+        logging.warning(f"⚠️ {symbol} Binance has no bars for {len(ranges)} ranges to repair")
+        return 0
+    fetched = pd.concat(fetched, ignore_index=True)
+    stored = get_stored_klines(symbol, first_bad, window_end)
+    window = pd.concat([stored, fetched[KLINE_COLUMNS]], ignore_index=True)
+    window = window.drop_duplicates(subset='timestamp', keep='last').sort_values('timestamp', ignore_index=True)
+
+    warmup = get_warmup_rows(symbol, first_bad - 1)
+    df = calculate_incremental_indicators(warmup, window, state)
+    save_data_into_database(df, symbol)
+
+    tail = 0
+    if window_end < stored_end:
+        tail = update_cumulative_tail(symbol, window_end)
+    logging.info(f"✅ {symbol} repaired {len(fetched)} fetched bars in {len(ranges)} ranges, "
+                 f"recomputed {len(df)} rows and {tail} cumulative tail rows")
+    return len(fetched)
+
+
+# gaps of every stored symbol (or `symbols`) plus the checker's findings
+def repair_all(symbols=None, report_file=CHECK_REPORT_FILE):
+    if symbols is None:
+        connection = get_database_connected()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT DISTINCT symbol FROM ***")
+                symbols = [row[0] for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+    reported = get_reported_ranges(report_file)
+    repaired = {}
+    for symbol in symbols:
+        ranges = find_gaps(symbol) + reported.get(symbol, [])
+        if not ranges:
+            continue
+        logging.info(f"🔍 {symbol} has {len(ranges)} ranges to repair")
+        try:
+            repaired[symbol] = repair_symbol(symbol, ranges)
+        except Exception as e:
+            logging.error(f"❌ {symbol} repair failed : {e}")
+    logging.info(f"📋 repaired {sum(repaired.values())} bars in {len(repaired)} symbols")
+    return repaired
+
+
+if __name__ == '__main__':
+    repair_all()
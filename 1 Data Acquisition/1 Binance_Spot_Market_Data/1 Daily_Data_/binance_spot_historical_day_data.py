@@ -2,6 +2,7 @@
 # get spot historical daily data
 
 import logging
+import threading
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -9,10 +10,21 @@ import pandas as pd
 import numpy as np
 import pymysql
 import os
-import time
 from dotenv import load_dotenv
 from dbutils.pooled_db import PooledDB
-from datetime import datetime, timedelta,timezone
+from datetime import datetime, timezone
+from binance_klines_fetcher import fetch_klines, fetch_klines_many, server_clock, SYMBOL_WORKERS, PAGE_WORKERS
+from kline_cache import KlineCache
+from indicator_registry import INDICATOR_DTYPE, compute_indicators
+from panel_indicators import calculate_indicators_for_frames
+from database_writer import (SAVE_BATCH_SIZE, INTERVAL_TABLES, build_value_rows, upsert_rows, load_data_rows,
+                             compute_row_hashes, select_changed_rows)
+from kline_digest import update_month_digests
+from pipeline import Stage, run_pipeline
+from symbol_screener import LONG_TOP, screen_scores, rescore_near_cutoff, top_symbols
+from universe_cache import UniverseCache
+from kline_resampler import SOURCE_INTERVAL, calculate_interval_indicators
+from metrics import metrics, configure_from_env
 
 
 
@@ -32,7 +44,6 @@ PASSWORD=os.getenv('***')
 DATABASE=os.getenv('***')
 
 # binance API
-BINANCE_KLINES_URL='https://api.binance.com/api/v3/klines'
 BINANCE_EXCHANGE_URL='https://api.binance.com/api/v3/exchangeInfo'
 API_TIMEOUT=5
 
@@ -50,9 +61,10 @@ session.mount('https://', HTTPAdapter(max_retries=retry))
 
 
 # database connection pool
+DB_MAX_CONNECTIONS=8
 pool=PooledDB(
     creator=pymysql,
-    maxconnections=8,
+    maxconnections=DB_MAX_CONNECTIONS,
     mincached=2,
     maxcached=4,
     blocking=True,
@@ -61,344 +73,391 @@ pool=PooledDB(
     password=PASSWORD,
     database=DATABASE,
     charset='utf8',
-    autocommit=True
+    autocommit=True,
+    # only used by save_data_into_database(use_load_data=True)
+    local_infile=True
 )
 
 
+# raw klines already downloaded are read from disk, only missing ranges hit the API
+kline_cache=KlineCache()
+# exchangeInfo symbols and screening scores kept between runs
+universe_cache=UniverseCache()
+
+
 # define database connection function
 def get_database_connected():
     return pool.connection()
 
-# use binance time
-BINANCE_TIME_URL = "https://api.binance.com/api/v3/time"
+# use binance time, the offset to the local clock is measured once and cached by the fetcher
 def get_binance_server_time():
     try:
-        response = requests.get(BINANCE_TIME_URL, timeout=API_TIMEOUT)
-        if response.status_code == 200:
-            server_time_ms = response.json().get('serverTime')
-            return datetime.fromtimestamp(server_time_ms / 1000, tz=timezone.utc)
-        else:
-            logging.error(f"⚠️ fail to get server time : {response.text}")
-            # if failed, use local time
-            return datetime.now(timezone.utc)
-    except Exception as e:
-        logging.error(f"⚠️ unknown error : {e}")
+        return datetime.fromtimestamp(server_clock.now_ms() / 1000, tz=timezone.utc)
+    # a failed request or a malformed /time payload
+    except (requests.exceptions.RequestException, KeyError, ValueError, TypeError) as e:
+        logging.error(f"⚠️ fail to get server time : {e}")
+        # if failed, use local time
         return datetime.now(timezone.utc)
 
 
 
 
 
+# background universe refreshes, __main__ waits for them so a new ranking is saved before exit
+refresh_threads=[]
+
 # get aim symbols
-def get_aim_symbols():
+# top 100 by 30-day mean quote volume among the top 200 by 14-day mean, both ranked from one
+# 30-day download, see symbol_screener. The symbol list and the scores are cached in
+# universe_cache.json: a fresh ranking is used as is, an expired one is returned right away and
+# refreshed in the background (only near the cutoff unless it is older than FULL_RANKING_TTL)
+def get_aim_symbols(use_ticker_prefilter=True, background_refresh=True):
+    scores=universe_cache.scores()
+    if scores and universe_cache.ranking_fresh():
+        return top_symbols(scores, LONG_TOP)
+    if scores and background_refresh:
+        logging.info("✅ collecting from the cached universe, refreshing it in the background")
+        thread=threading.Thread(target=refresh_aim_symbols_in_background, args=(use_ticker_prefilter,),
+                                name='universe-refresh')
+        refresh_threads.append(thread)
+        thread.start()
+        return top_symbols(scores, LONG_TOP)
+    return refresh_aim_symbols(use_ticker_prefilter)
+
+
+# TRADING symbols from exchangeInfo, downloaded again only after EXCHANGE_INFO_TTL
+def get_trading_symbols():
+    if universe_cache.trading_symbols() is not None and universe_cache.trading_symbols_fresh():
+        return universe_cache.trading_symbols()
+    response = session.get(BINANCE_EXCHANGE_URL, timeout=API_TIMEOUT)
+    response.raise_for_status()
+    exchange_symbols = response.json()
+    all_symbols = [s['symbol'] for s in exchange_symbols['symbols'] if s['status'] == 'TRADING']
+    universe_cache.save_trading_symbols(all_symbols)
+    return all_symbols
+
+
+def refresh_aim_symbols(use_ticker_prefilter=True):
     try:
-        response = session.get(BINANCE_EXCHANGE_URL, timeout=API_TIMEOUT)
-        response.raise_for_status()
-        exchange_symbols = response.json()
-        all_symbols = [s['symbol'] for s in exchange_symbols['symbols'] if s['status'] == 'TRADING']
-
-        # get binance server time and calculate timestamp
-        binance_time = get_binance_server_time()
-        start_date_short = (binance_time - timedelta(days=14)).strftime('%Y-%m-%d')
-        start_date_long = (binance_time - timedelta(days=30)).strftime('%Y-%m-%d')
-
-        # make two selection to select top 100 trading symbols
-        # first selection
-        volume_data_short = []
-        for symbol in all_symbols:
-            df = get_historical_klines(symbol, start_date_short)
-            if df is not None and not df.empty:
-                volume_data_short.append((symbol, df['quote_volume'].astype(float).mean()))
-            time.sleep(0.25)
-
-        sorted_symbols_short = sorted(volume_data_short, key=lambda x: x[1], reverse=True)
-        top_200_symbols = [symbol[0] for symbol in sorted_symbols_short[:200]]
-
-        # second selection
-        volume_data_long = []
-        for symbol in top_200_symbols:
-            df = get_historical_klines(symbol, start_date_long)
-            if df is not None and not df.empty:
-                volume_data_long.append((symbol, df['quote_volume'].astype(float).mean()))
-            time.sleep(0.25)
-
-        sorted_symbols_long = sorted(volume_data_long, key=lambda x: x[1], reverse=True)
-        return [symbol[0] for symbol in sorted_symbols_long[:100]]
+        previous_symbols=universe_cache.trading_symbols() or []
+        all_symbols=get_trading_symbols()
+        scores=universe_cache.scores()
+        if scores and universe_cache.full_ranking_fresh():
+            new_symbols=sorted(set(all_symbols)-set(previous_symbols))
+            scores=rescore_near_cutoff(scores, all_symbols, new_symbols, kline_cache)
+            universe_cache.save_scores(scores, full=False)
+        else:
+            scores=screen_scores(all_symbols, kline_cache, use_ticker_prefilter)
+            universe_cache.save_scores(scores, full=True)
+        return top_symbols(scores, LONG_TOP)
 
     except requests.exceptions.RequestException as e:
         logging.error(f'⚠️ fail to fetch symbols : {e}')
         return []
 
 
+# nothing waits on the result of a background refresh, so its errors are logged here
+def refresh_aim_symbols_in_background(use_ticker_prefilter=True):
+    try:
+        refresh_aim_symbols(use_ticker_prefilter)
+    except Exception as e:
+        logging.error(f'❌ background universe refresh failed : {e}')
+
+
 
 # get historical klines data
 # **********************************************************************************************
 
+# pages are fetched concurrently through the shared rate limiter in binance_klines_fetcher
 def get_historical_klines(symbol, start_date, interval='1d'):
-    start_time = int(pd.Timestamp(start_date, tz='UTC').timestamp() * 1000)
     end_time = int(get_binance_server_time().timestamp() * 1000)
-    all_data = []
-    last_timestamp = None
+    return fetch_klines(symbol, start_date, interval, end=end_time, cache=kline_cache)
 
 
-    while start_time < end_time:
-        params = {
-            'symbol': symbol,
-            'interval': interval,
-            'startTime': start_time,
-            'limit': 1000
-        }
+# calculate the financial indicators
+# every indicator is declared in indicator_registry with its inputs, `columns` selects a subset
+# (all stored indicators by default) and only what those need is computed.
+# the columns stay typed, undefined values are NaN until database_writer turns them into NULL
+def calculate_financial_indicators(df, columns=None, dtype=INDICATOR_DTYPE):
+
+    df=compute_indicators(df, columns, dtype)
+
+    return df
+
+
+# save data into database
+# rows are built column-wise and written in chunked multi-row upserts (or LOAD DATA + one merge),
+# the affected-row counts replace the COUNT(*) scans before and after every save.
+# with only_changed, rows whose content hash matches the stored row_hash are not sent at all.
+# the month digests of the written range are refreshed in the same explicit transaction.
+# bars of other intervals than 1d go to their own table in INTERVAL_TABLES.
+# the whole save is timed as db_save_seconds, every upsert batch as db_batch_seconds (see metrics)
+def save_data_into_database(df, symbol, batch_size=SAVE_BATCH_SIZE, use_load_data=False, only_changed=True,
+                            interval='1d'):
+
+    if df is None or df.empty:
+        logging.warning(f"{symbol} is empty, skip saving")
+        return
+    table=INTERVAL_TABLES[interval]
+    with metrics.timer('db_save_seconds', symbol, interval=interval):
+        connection=None
         try:
-            response = session.get(BINANCE_KLINES_URL, params=params, timeout=API_TIMEOUT)
-            response.raise_for_status()
-            data = response.json()
+            connection=get_database_connected()
+            with connection.cursor() as cursor:
+                df=df.assign(row_hash=compute_row_hashes(df))
+                if only_changed:
+                    total=len(df)
+                    df=select_changed_rows(cursor, df, symbol, table)
+                    metrics.count('rows_unchanged_total', total-len(df), table=table)
+                    logging.info(f"{symbol} {interval} {len(df)} of {total} rows are new or changed")
+                    if df.empty:
+                        return
+                values=build_value_rows(df, symbol)
+                # the pool runs in autocommit, the rows and their month digests commit together
+                connection.begin()
+                if use_load_data:
+                    affected=load_data_rows(cursor, values, table)
+                else:
+                    affected=upsert_rows(cursor, values, batch_size, table)
+                months=0
+                if interval=='1d':
+                    months=update_month_digests(cursor, symbol, int(df['timestamp'].min()), int(df['timestamp'].max()))
+                connection.commit()
+                # affected = inserted + 2 * updated, rows that did not change count 0
+                logging.info(f"{symbol} {interval} sent {len(values)} rows, {affected} rows affected, {months} month digests updated")
+            logging.info(f"{symbol} data saved successfully.")
+        except Exception as e:
+            if connection:
+                connection.rollback()
+            logging.error(f"{symbol} failed to save data:{e}")
+        finally:
+            if connection:
+                connection.close()
 
 
-            if not isinstance(data, list) or len(data) == 0:
-                logging.warning(f"⚠️ {symbol} is empty or fail to fetch : {data}")
-                break
+# incremental collection
+# **********************************************************************************************
 
+# rows pulled back before the first new bar, covers the 200-bar SMA window and lets the
+# un-stored EMA_12/EMA_26 (MACD) and K/D converge to float precision
+WARMUP_BARS=300
+EMA_PERIODS=[5,10,20,50,100,200]
+KLINE_COLUMNS=['timestamp','trade_date','open','high','low','close','volume','quote_volume','trades']
 
-            df = pd.DataFrame(data, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_volume', 'trades',
-                'takerBuyBaseAssetVolume', 'takerBuyQuoteAssetVolume', 'ignore'
-            ])
 
-            df.drop(columns=['close_time', 'takerBuyBaseAssetVolume', 'takerBuyQuoteAssetVolume', 'ignore'],
-                    inplace=True)
+# last stored bar, row count and cumulative volume per symbol in one grouped query
+def get_stored_state(symbols):
+    if not symbols:
+        return {}
+    connection=None
+    try:
+        connection=get_database_connected()
+        with connection.cursor() as cursor:
+            placeholders=', '.join(['%s']*len(symbols))
+            cursor.execute(f"""
+                SELECT symbol, MAX(timestamp), COUNT(*), SUM(volume)
+                FROM ***
+                WHERE symbol IN ({placeholders})
+                GROUP BY symbol
+            """, tuple(symbols))
+            data=cursor.fetchall()
+    except Exception as e:
+        logging.error(f"❌ fail to read stored state : {e}")
+        return {}
+    finally:
+        if connection:
+            connection.close()
 
-            df = df.astype({
-                'open': float, 'high': float, 'low': float, 'close': float,
-                'volume': float, 'quote_volume': float, 'trades': int
-            })
+    return {row[0]: {'last_timestamp': int(row[1]), 'count': int(row[2]), 'cumulative_volume': float(row[3])}
+            for row in data}
 
-            df['trade_date'] = pd.to_datetime(df['timestamp'], unit='ms').dt.date
 
+# the last `bars` stored rows up to and including `last_timestamp`, oldest first
+def get_warmup_rows(symbol, last_timestamp, bars=WARMUP_BARS):
+    columns=KLINE_COLUMNS+[f'EMA_{period}' for period in EMA_PERIODS]+['VWAP','OBV','max_drawdown']
+    connection=None
+    try:
+        connection=get_database_connected()
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {', '.join(columns)}
+                FROM ***
+                WHERE symbol = %s AND timestamp <= %s
+                ORDER BY timestamp DESC
+                LIMIT %s
+            """, (symbol, last_timestamp, bars))
+            data=cursor.fetchall()
+    finally:
+        if connection:
+            connection.close()
 
-            if last_timestamp and df.iloc[-1]['timestamp'] == last_timestamp:
-                logging.warning(f"⚠️ {symbol} API return repeat data and break the loop")
-                break
+    df=pd.DataFrame(list(reversed(data)), columns=columns)
+    float_columns=[c for c in columns if c not in ('timestamp','trade_date','trades')]
+    df[float_columns]=df[float_columns].astype(float)
+    return df.astype({'timestamp':'int64','trades':'int64'})
 
-            if df.empty:
-                logging.warning(f"⚠️ {symbol} is empty and break the loop")
-                break
 
-            all_data.append(df)
-            last_timestamp = df.iloc[-1]['timestamp']
+# compute indicators for the freshly fetched bars only
+# the last stored bar is fetched again (it may have been saved while still open), so the warm-up
+# ends right before it. When the stored history is longer than the warm-up window, the indicators
+# that depend on the whole history are continued from the last stored values instead of replayed
+def calculate_incremental_indicators(warmup, new, stored):
+    first_new=new['timestamp'].iloc[0]
+    replaced=warmup[warmup['timestamp']>=first_new]
+    warmup=warmup[warmup['timestamp']<first_new].reset_index(drop=True)
 
+    df=pd.concat([warmup[KLINE_COLUMNS],new[KLINE_COLUMNS]],ignore_index=True)
+    df=calculate_financial_indicators(df)
+    result=df.iloc[len(warmup):].reset_index(drop=True)
 
-            interval_ms = {
-                '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000,
-                '30m': 1800000, '1h': 3600000, '2h': 7200000, '4h': 14400000,
-                '6h': 21600000, '8h': 28800000, '12h': 43200000, '1d': 86400000
-            }
+    previous_count=stored['count']-len(replaced)
+    if previous_count<=len(warmup) or warmup.empty:
+        return result
 
-            start_time = last_timestamp + interval_ms.get(interval, 86400000)
+    last=warmup.iloc[-1]
+    close=new['close'].reset_index(drop=True)
+    volume=new['volume'].reset_index(drop=True)
 
-            logging.info(f"✅ {symbol} get {len(df)} rows data，all are {sum(len(d) for d in all_data)} rows")
+    # EMA(adjust=False) continues exactly from the previous value
+    for period in EMA_PERIODS:
+        seed=last[f'EMA_{period}']
+        if pd.notna(seed):
+            seeded=pd.concat([pd.Series([seed]),close],ignore_index=True)
+            result[f'EMA_{period}']=seeded.ewm(span=period,adjust=False).mean().iloc[1:].to_numpy()
 
-            # API management
-            headers = response.headers
-            used_weight = int(headers.get('X-MBX-USED-WEIGHT-1M', 0))
-            if used_weight > 1100:
-                logging.warning("⏸️ API limitation, stop fpr 10 seconds")
-                time.sleep(10)
-            elif used_weight > 900:
-                logging.warning("⏸️ API go on to the top limitation, stop for 5 seconds")
-                time.sleep(5)
-            else:
-                time.sleep(0.2)
+    # OBV, VWAP and max_drawdown are cumulative over the full history
+    close_change=np.sign(pd.concat([pd.Series([last['close']]),close],ignore_index=True).diff().iloc[1:].to_numpy())
+    result['OBV']=last['OBV']+np.cumsum(close_change*volume.to_numpy())
 
+    cumulative_volume=stored['cumulative_volume']-replaced['volume'].sum()
+    typical_price=(new['high']+new['low']+new['close']).to_numpy()/3
+    result['VWAP']=((last['VWAP']*cumulative_volume+np.cumsum(typical_price*volume.to_numpy()))
+                    /(cumulative_volume+np.cumsum(volume.to_numpy())))
 
-        except requests.exceptions.RequestException as e:
-            logging.error(f"❌ {symbol} API fail to fetch : {e}")
-            break
-        except Exception as e:
-            logging.error(f"❌ {symbol} data process error : {e}")
-            break
+    running_max=last['close']/(1+last['max_drawdown'])
+    result['max_drawdown']=close.to_numpy()/np.maximum.accumulate(np.maximum(close.to_numpy(),running_max))-1
 
-    return pd.concat(all_data, ignore_index=True) if all_data else None
+    return result
 
 
-# calculate the financial indicators
-def calculate_financial_indicators(df):
-
-    # SMA and EMA
-    for period in [5,10,20,50,100,200]:
-        df[f'SMA_{period}']=df['close'].rolling(period,min_periods=period).mean()
-        df[f'EMA_{period}']=df['close'].ewm(span=period,min_periods=period,adjust=False).mean()
-
-    # volume moving averages
-    for period in [5,10,20]:
-        df[f'volume_MA_{period}']=df['volume'].rolling(window=period,min_periods=period).mean()
-
-
-    # RSI
-    delta=df['close'].diff()
-    gain=delta.clip(lower=0).rolling(window=14,min_periods=14).mean()
-    loss=(-delta.clip(upper=0)).rolling(window=14,min_periods=14).mean()
-
-    # in case of dividing "0" so plus "1e-10"
-    rs=gain/(loss+1e-10)
-    df['RSI_14']=100-(100/(1+rs))
-
-    # VWAP
-    typical_price=(df['high']+df['low']+df['close'])/3
-    df['cumulative_typical_price_volume']=(typical_price*df['volume']).cumsum()
-    df['cumulative_volume']=df['volume'].cumsum()
-    df['VWAP']=df['cumulative_typical_price_volume']/df['cumulative_volume']
-
-
-    # OBV
-    df['OBV']=(np.sign(df['close'].diff())*df['volume']).fillna(0).cumsum()
-
-
-    # MACD
-    df['EMA_12']=df['close'].ewm(span=12,adjust=False).mean()
-    df['EMA_26']=df['close'].ewm(span=26,adjust=False).mean()
-    df['MACD']=df['EMA_12']-df['EMA_26']
-    df['MACD_single']=df['MACD'].ewm(span=9,adjust=False).mean()
-
-    # KDJ
-    df['lowest_low_14']=df['low'].rolling(window=14,min_periods=14).min()
-    df['highest_high_14']=df['high'].rolling(window=14,min_periods=14).max()
-    df['RSV']=(df['close']-df['lowest_low_14'])/(df['highest_high_14']-df['lowest_low_14']+1e-10)*100
-    df['K']=df['RSV'].ewm(com=2,adjust=False,min_periods=14).mean()
-    df['D']=df['K'].ewm(com=2,adjust=False,min_periods=14).mean()
-    df['J']=3*df['K']-2*df['D']
-
-    # ATR
-    tr1=df['high']-df['low']
-    tr2=(df['high']-df['close'].shift(1)).abs()
-    tr3=(df['low']-df['close'].shift(1)).abs()
-    df['TR']=pd.concat([tr1,tr2,tr3],axis=1).max(axis=1)
-    df['ATR']=df['TR'].rolling(window=14,min_periods=14).mean()
-
-    # Bollinger bands
-    df['bollinger_middle']=df['SMA_20']
-    rolling_std=df['close'].rolling(window=20,min_periods=20).std()
-    df['bollinger_upper']=df['bollinger_middle']+(rolling_std*2)
-    df['bollinger_lower']=df['bollinger_middle']-(rolling_std*2)
-
-    # Risk management indicators___MDD and sharpe_ratio
-    df['max_drawdown'] = (df['close'] / df['close'].cummax()) - 1
-    # sharpe ratio
-    df['return']=df['close'].pct_change()
-    df['rolling_mean_return']=df['return'].rolling(window=20,min_periods=20).mean()
-    df['rolling_std_return']=df['return'].rolling(window=20,min_periods=20).std()
-    df['sharpe_ratio']=df['rolling_mean_return']/(df['rolling_std_return']+1e-10)
-
-    df.replace({np.nan: None}, inplace=True)
-    return df
+# fetch only the bars after the last stored one and write only those rows
+def collect_incremental(symbols, start_date):
+    stored_state=get_stored_state(symbols)
+    starts={symbol: stored_state[symbol]['last_timestamp'] if symbol in stored_state else start_date
+            for symbol in symbols}
+    klines=fetch_klines_many(symbols, starts, cache=kline_cache)
 
+    for symbol in symbols:
+        df=klines[symbol]
+        if df is None:
+            continue
+        with metrics.symbol(symbol):
+            try:
+                if symbol in stored_state:
+                    warmup=get_warmup_rows(symbol, stored_state[symbol]['last_timestamp'])
+                    df=calculate_incremental_indicators(warmup, df, stored_state[symbol])
+                else:
+                    df=calculate_financial_indicators(df)
+            except Exception as e:
+                logging.error(f"❌ {symbol} incremental indicators failed : {e}")
+                continue
+            save_data_into_database(df, symbol)
 
-# save data into database
-def save_data_into_database(df, symbol):
 
-    if df is None or df.empty:
-        logging.warning(f"{symbol} is empty, skip saving")
-        return
-    connection=None
-    try:
-        connection=get_database_connected()
-        with connection.cursor() as cursor:
-            # save data before saving data
-            cursor.execute("SELECT COUNT(*) FROM *** WHERE symbol = %s", (symbol,))
-            before_count = cursor.fetchone()[0]
-            logging.info(f"Before saving {symbol} there are already {before_count} rows data")
-            sql = """
-                INSERT INTO *** (
-                    symbol, trade_date, timestamp,open, high, low, close, volume, quote_volume, trades,
-                    SMA_5, SMA_10, SMA_20, SMA_50, SMA_100, SMA_200,
-                    EMA_5, EMA_10, EMA_20, EMA_50, EMA_100, EMA_200,
-                    volume_MA_5, volume_MA_10, volume_MA_20, 
-                    RSI_14, VWAP, OBV, 
-                    MACD, MACD_single, K, D, J, ATR, 
-                    bollinger_middle, bollinger_upper, bollinger_lower,
-                    max_drawdown, sharpe_ratio
-                ) VALUES (
-                    %s, %s,
-                    %s, %s, %s, %s, %s, 
-                    %s, %s, %s, %s, %s, %s, 
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 
-                    %s, %s, %s, %s, %s, %s, %s, %s, 
-                    %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                ON DUPLICATE KEY UPDATE
-                    open = VALUES(open),
-                    high = VALUES(high),
-                    low = VALUES(low),
-                    close = VALUES(close),
-                    volume = VALUES(volume),
-                    quote_volume = VALUES(quote_volume),
-                    trades = VALUES(trades),
-                    SMA_5 = VALUES(SMA_5),
-                    SMA_10 = VALUES(SMA_10),
-                    SMA_20 = VALUES(SMA_20),
-                    SMA_50 = VALUES(SMA_50),
-                    SMA_100 = VALUES(SMA_100),
-                    SMA_200 = VALUES(SMA_200),
-                    EMA_5 = VALUES(EMA_5),
-                    EMA_10 = VALUES(EMA_10),
-                    EMA_20 = VALUES(EMA_20),
-                    EMA_50 = VALUES(EMA_50),
-                    EMA_100 = VALUES(EMA_100),
-                    EMA_200 = VALUES(EMA_200),
-                    volume_MA_5 = VALUES(volume_MA_5),
-                    volume_MA_10 = VALUES(volume_MA_10),
-                    volume_MA_20 = VALUES(volume_MA_20),
-                    RSI_14 = VALUES(RSI_14),
-                    VWAP = VALUES(VWAP),
-                    OBV = VALUES(OBV),
-                    MACD = VALUES(MACD),
-                    MACD_single = VALUES(MACD_single),
-                    K = VALUES(K),
-                    D = VALUES(D),
-                    J = VALUES(J),
-                    ATR = VALUES(ATR),
-                    bollinger_middle = VALUES(bollinger_middle),
-                    bollinger_upper = VALUES(bollinger_upper),
-                    bollinger_lower = VALUES(bollinger_lower),
-                    max_drawdown = VALUES(max_drawdown),
-                    sharpe_ratio = VALUES(sharpe_ratio)
-            """
-            values=[(
-                symbol,row['trade_date'],row['timestamp'],
-                    row['open'], row['high'], row['low'], row['close'],
-                    row['volume'], row['quote_volume'], row['trades'],
-                    row['SMA_5'], row['SMA_10'], row['SMA_20'], row['SMA_50'], row['SMA_100'], row['SMA_200'],
-                    row['EMA_5'], row['EMA_10'], row['EMA_20'], row['EMA_50'], row['EMA_100'], row['EMA_200'],
-                    row['volume_MA_5'], row['volume_MA_10'], row['volume_MA_20'],
-                    row['RSI_14'], row['VWAP'], row['OBV'],
-                    row['MACD'], row['MACD_single'],
-                    row['K'], row['D'], row['J'],
-                    row['ATR'], row['bollinger_middle'], row['bollinger_upper'], row['bollinger_lower'],
-                    row['max_drawdown'], row['sharpe_ratio']
-                )for _, row in df.iterrows()]
-            cursor.executemany(sql, values)
-            connection.commit()
-            # check data rows after saving
-            cursor.execute("SELECT COUNT(*) FROM *** WHERE symbol = %s", (symbol,))
-            after_count = cursor.fetchone()[0]
-            logging.info(f"{symbol} after saving data, the rows of data are {after_count}")
-        logging.info(f"{symbol} data saved successfully.")
-    except Exception as e:
-        if connection:
-            connection.rollback()
-        logging.error(f"{symbol} failed to save data:{e}")
-    finally:
-        if connection:
-            connection.close()
+# pipelined full collection
+# **********************************************************************************************
+
+# symbols downloading at once (each with its own pages in flight), all share the fetcher's rate limiter
+# and its connection pool, which is sized for these
+FETCH_WORKERS=SYMBOL_WORKERS
+FETCH_PAGE_WORKERS=PAGE_WORKERS
+# indicator processes
+COMPUTE_WORKERS=max(1, (os.cpu_count() or 2)-1)
+# symbols per panel call, the panel's cost grows far slower than the number of its columns
+PANEL_BATCH_SIZE=32
+# one writer per pooled connection
+STORE_WORKERS=DB_MAX_CONNECTIONS
+
+
+def fetch_stage(symbol, request):
+    start_date, end_time, interval=request
+    return fetch_klines(symbol, start_date, interval, end=end_time, max_workers=FETCH_PAGE_WORKERS, cache=kline_cache)
+
+
+def store_stage(symbol, df):
+    save_data_into_database(df, symbol)
+    return True
+
+
+# fetch, indicators and store overlap: while one symbol is being written the next ones are
+# computed in the process pool and further ones downloaded, bounded queues keep memory flat.
+# the indicators stage gathers PANEL_BATCH_SIZE fetched symbols and runs the panel engine once for them.
+# store(symbol, df) writes one symbol's rows, the default writes to the daily table, so another
+# interval needs a store for its own table (the end-to-end benchmark passes one)
+def collect_pipelined(symbols, start_date, interval='1d', store=store_stage):
+    end_time=get_binance_server_time()
+    return run_pipeline({symbol: (start_date, end_time, interval) for symbol in symbols}, [
+        Stage('fetch', fetch_stage, FETCH_WORKERS),
+        Stage('indicators', calculate_indicators_for_frames, COMPUTE_WORKERS, processes=True, batch=PANEL_BATCH_SIZE),
+        Stage('store', store, STORE_WORKERS),
+    ])
+
+
+# intraday collection
+# **********************************************************************************************
+
+# 1m history is large, it starts later than the daily history
+INTRADAY_START_DATE='**'
+
+
+def fetch_minute_stage(symbol, time_range):
+    start_date, end_time=time_range
+    return fetch_klines(symbol, start_date, SOURCE_INTERVAL, end=end_time, max_workers=FETCH_PAGE_WORKERS,
+                        cache=kline_cache)
+
+
+def store_intervals_stage(symbol, frames):
+    for interval, df in frames.items():
+        save_data_into_database(df, symbol, interval=interval)
+    return True
+
+
+# download only 1m bars and derive 5m/15m/1h/4h from them, every interval gets the same
+# indicator set and its own table, API weight no longer grows with the number of intervals.
+# the daily table is left to the daily collection, its indicators need the full daily history
+def collect_intraday(symbols, start_date=INTRADAY_START_DATE):
+    end_time=get_binance_server_time()
+    # years of 1m bars are hundreds of MB per symbol, so only a few wait in each queue
+    return run_pipeline({symbol: (start_date, end_time) for symbol in symbols}, [
+        Stage('fetch', fetch_minute_stage, FETCH_WORKERS),
+        Stage('indicators', calculate_interval_indicators, COMPUTE_WORKERS, processes=True),
+        Stage('store', store_intervals_stage, STORE_WORKERS),
+    ], queue_size=COMPUTE_WORKERS)
+
 
 if __name__ == '__main__':
     start_date='**'
-    symbols = get_aim_symbols()
-    for symbol in symbols:
-        df = get_historical_klines(symbol,start_date)
-        if df is not None:
-            df = calculate_financial_indicators(df)
-            save_data_into_database(df, symbol)
+    # set to False to re-download and rewrite the whole history from start_date
+    incremental=True
+    # download 1m bars once and derive every higher interval locally
+    intraday=False
+    # metrics.jsonl gets a snapshot every METRICS_FLUSH_SECONDS and at the end,
+    # METRICS_PORT serves /metrics, PROFILE_SYMBOL writes a cProfile of that symbol
+    configure_from_env()
+    stop_flushing=metrics.flush_periodically('collector')
+    try:
+        symbols = get_aim_symbols()
+        if intraday:
+            collect_intraday(symbols)
+        elif incremental:
+            collect_incremental(symbols, start_date)
+        else:
+            collect_pipelined(symbols, start_date)
+    finally:
+        for thread in refresh_threads:
+            thread.join()
+        stop_flushing.set()
+        metrics.flush('collector')
 
 
 
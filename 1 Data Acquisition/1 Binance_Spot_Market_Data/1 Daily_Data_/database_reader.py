@@ -0,0 +1,51 @@
+# streaming reads from the kline table into preallocated typed numpy arrays
+# rows come from a server-side cursor in chunks, so no full python result set is ever built
+
+import numpy as np
+import pandas as pd
+from pymysql.cursors import SSCursor
+
+
+
+FETCH_SIZE = 10000
+# rows preallocated when the caller has no row count, the arrays double when they fill up
+DEFAULT_CAPACITY = 4096
+
+
+
+# read every row of `sql` into one array per column with the given dtypes (NULL floats become NaN)
+def stream_columns(connection, sql, params, dtypes, expected_rows=0, fetch_size=FETCH_SIZE):
+    capacity = max(int(expected_rows), 1) if expected_rows else DEFAULT_CAPACITY
+    arrays = [np.empty(capacity, dtype=dtype) for dtype in dtypes]
+    size = 0
+
+    with connection.cursor(SSCursor) as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            if size + len(rows) > capacity:
+                capacity = max(capacity * 2, size + len(rows))
+                arrays = [np.resize(array, capacity) for array in arrays]
+            for array, values in zip(arrays, zip(*rows)):
+                array[size:size + len(rows)] = values
+            size += len(rows)
+
+    return [array[:size] for array in arrays]
+
+
+def stream_dataframe(connection, sql, params, columns, expected_rows=0, fetch_size=FETCH_SIZE):
+    arrays = stream_columns(connection, sql, params, list(columns.values()), expected_rows, fetch_size)
+    return pd.DataFrame(dict(zip(columns, arrays)))
+
+
+# split a frame ordered by symbol into {symbol: frame} without a groupby copy per row
+def split_by_symbol(df):
+    if df.empty:
+        return {}
+    symbols = df['symbol'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+    ends = np.r_[starts[1:], len(df)]
+    return {symbols[start]: df.iloc[start:end].drop(columns='symbol').reset_index(drop=True)
+            for start, end in zip(starts, ends)}
@@ -0,0 +1,138 @@
+# bulk write path for the kline tables
+# rows are built column by column (no iterrows) and sent as chunked multi-row upserts,
+# or through a staging table filled with LOAD DATA LOCAL INFILE and merged in one statement
+
+import csv
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+
+INSERT_COLUMNS = [
+    'symbol', 'trade_date', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trades',
+    'SMA_5', 'SMA_10', 'SMA_20', 'SMA_50', 'SMA_100', 'SMA_200',
+    'EMA_5', 'EMA_10', 'EMA_20', 'EMA_50', 'EMA_100', 'EMA_200',
+    'volume_MA_5', 'volume_MA_10', 'volume_MA_20',
+    'RSI_14', 'VWAP', 'OBV',
+    'MACD', 'MACD_single', 'K', 'D', 'J', 'ATR',
+    'bollinger_middle', 'bollinger_upper', 'bollinger_lower',
+    'max_drawdown', 'sharpe_ratio', 'row_hash'
+]
+UPDATE_COLUMNS = INSERT_COLUMNS[3:]
+
+# content hash of every stored value, kept in `row_hash BIGINT UNSIGNED` next to the row
+HASH_COLUMNS = INSERT_COLUMNS[3:-1]
+# mantissa bits kept before hashing (~1e-11 relative), so float noise from recomputing
+# the indicators does not count as a change
+HASH_MANTISSA_BITS = 36
+
+# rows per multi-row INSERT, ~1000 rows x 39 columns stays well below max_allowed_packet
+SAVE_BATCH_SIZE = 1000
+
+UPSERT_PREFIX = "INSERT INTO {table} (" + ', '.join(INSERT_COLUMNS) + ") VALUES "
+UPSERT_SUFFIX = " ON DUPLICATE KEY UPDATE " + ', '.join(f'{c} = VALUES({c})' for c in UPDATE_COLUMNS)
+ROW_PLACEHOLDER = '(' + ', '.join(['%s'] * len(INSERT_COLUMNS)) + ')'
+
+STAGING_TABLE = '***_staging'
+
+# one table per interval with the same columns, daily bars stay in the original table
+INTERVAL_TABLES = {
+    '1m': '***_1m', '5m': '***_5m', '15m': '***_15m', '1h': '***_1h', '4h': '***_4h',
+    '1d': '***',
+}
+
+
+
+# python values for one column, NaN/NaT become None so the driver writes NULL. This is the only
+# place NULLs exist, the frames keep typed float columns; float32 columns are widened to python floats
+def column_values(series):
+    if series.dtype.kind == 'f':
+        floats = series.to_numpy(dtype='float64')
+        values = floats.astype(object)
+        values[np.isnan(floats)] = None
+        return values.tolist()
+    values = series.to_numpy(dtype=object, copy=True)
+    values[series.isna().to_numpy()] = None
+    return values.tolist()
+
+
+# tuples in INSERT_COLUMNS order, built column-wise instead of with df.iterrows()
+def build_value_rows(df, symbol):
+    columns = [column_values(df[column]) for column in INSERT_COLUMNS[1:]]
+    return list(zip([symbol] * len(df), *columns))
+
+
+def build_upsert_sql(row_count, table='***'):
+    return UPSERT_PREFIX.format(table=table) + ', '.join([ROW_PLACEHOLDER] * row_count) + UPSERT_SUFFIX
+
+
+# one uint64 per row over the rounded OHLCV and indicator values, NULL hashes like NaN
+def compute_row_hashes(df):
+    values = df[HASH_COLUMNS].astype(float).to_numpy()
+    mantissa, exponent = np.frexp(values)
+    rounded = np.ldexp(np.round(np.ldexp(mantissa, HASH_MANTISSA_BITS)), exponent - HASH_MANTISSA_BITS)
+    return pd.util.hash_pandas_object(pd.DataFrame(rounded), index=False).to_numpy()
+
+
+# keep only the rows whose hash is new or differs from the stored one, one query per symbol
+def select_changed_rows(cursor, df, symbol, table='***'):
+    cursor.execute(f"""
+        SELECT timestamp, row_hash
+        FROM {table}
+        WHERE symbol = %s AND timestamp BETWEEN %s AND %s
+    """, (symbol, int(df['timestamp'].min()), int(df['timestamp'].max())))
+    stored = cursor.fetchall()
+    if not stored:
+        return df
+    # rows written before row_hash existed have NULL and are always rewritten once
+    stored_timestamps = np.array([row[0] for row in stored], dtype='int64')
+    stored_hashes = np.array([row[1] or 0 for row in stored], dtype='uint64')
+    position = pd.Index(stored_timestamps).get_indexer(df['timestamp'].to_numpy(dtype='int64'))
+    changed = (position < 0) | (stored_hashes[position] != df['row_hash'].to_numpy(dtype='uint64'))
+    return df[changed]
+
+
+# send the rows as multi-row upserts of `batch_size`, returns the affected-row count
+# (1 per inserted row, 2 per updated row, 0 per unchanged row)
+def upsert_rows(cursor, rows, batch_size=SAVE_BATCH_SIZE, table='***'):
+    affected = 0
+    full_batch_sql = build_upsert_sql(batch_size, table)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        sql = full_batch_sql if len(batch) == batch_size else build_upsert_sql(len(batch), table)
+        with metrics.timer('db_batch_seconds', table=table):
+            affected += cursor.execute(sql, [value for row in batch for value in row])
+    metrics.count('rows_written_total', len(rows), table=table)
+    return affected
+
+
+# LOAD DATA LOCAL INFILE into a session temporary table, then one INSERT ... SELECT merge.
+# needs local_infile enabled on both the connection and the server
+def load_data_rows(cursor, rows, table='***'):
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STAGING_TABLE}")
+    cursor.execute(f"CREATE TEMPORARY TABLE {STAGING_TABLE} LIKE {table}")
+
+    handle, path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(handle, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerows(['\\N' if value is None else value for value in row] for row in rows)
+        cursor.execute(f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE {STAGING_TABLE}
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+            LINES TERMINATED BY '\\n'
+            ({', '.join(INSERT_COLUMNS)})
+        """, (path,))
+    finally:
+        os.remove(path)
+
+    columns = ', '.join(INSERT_COLUMNS)
+    with metrics.timer('db_batch_seconds', table=table):
+        affected = cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {STAGING_TABLE}" + UPSERT_SUFFIX)
+    metrics.count('rows_written_total', len(rows), table=table)
+    return affected
+
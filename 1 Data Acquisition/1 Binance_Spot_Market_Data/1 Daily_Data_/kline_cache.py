@@ -0,0 +1,172 @@
+# local columnar cache of closed klines shared by the collector and the checker
+#
+# layout: {root}/{symbol}/{interval}/{YYYY-MM}/{segment}.arrow plus {root}/{symbol}/{interval}/coverage.json
+# every write adds a new Arrow IPC segment (append-only), reads memory-map the segments of the
+# requested months. coverage.json holds the open-time range [covered_from, covered_to] whose bars
+# are all in the cache (including stretches where the exchange has no bars at all).
+# reads and writes of one (symbol, interval) are serialized by a lock per pair, temporary files get
+# unique names, so the collector and a background universe refresh can share one cache
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+
+
+KLINE_CACHE_DIR = os.getenv('KLINE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kline_cache'))
+
+CACHE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trades']
+CACHE_SCHEMA = pa.schema([
+    ('timestamp', pa.int64()),
+    ('open', pa.float64()), ('high', pa.float64()), ('low', pa.float64()), ('close', pa.float64()),
+    ('volume', pa.float64()), ('quote_volume', pa.float64()),
+    ('trades', pa.int64()),
+])
+
+# months with more segments than this are merged into one on the next write
+MAX_SEGMENTS_PER_MONTH = 8
+
+
+
+def _month(timestamp_ms):
+    return pd.Timestamp(timestamp_ms, unit='ms').strftime('%Y-%m')
+
+
+# another process may compact the month while it is listed, its merged segment is written before
+# the old ones are removed, so listing again finds every bar
+def _read_segments(month_directory):
+    while True:
+        segments = sorted(s for s in os.listdir(month_directory) if s.endswith('.arrow'))
+        tables = []
+        try:
+            for segment in segments:
+                with pa.memory_map(os.path.join(month_directory, segment)) as source:
+                    tables.append(pa.ipc.open_file(source).read_all())
+        except FileNotFoundError:
+            continue
+        return segments, tables
+
+
+# a uniquely named temporary file in `directory`, os.replace moves it into place
+def _temporary_path(directory):
+    handle, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(handle)
+    return path
+
+
+# segment names sort in write order, the temporary name keeps readers from seeing half a file
+def _write_segment(month_directory, table):
+    path = os.path.join(month_directory, f'{time.time_ns()}-{os.getpid()}.arrow')
+    temporary = _temporary_path(month_directory)
+    with pa.OSFile(temporary, 'wb') as sink:
+        with pa.ipc.new_file(sink, CACHE_SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(temporary, path)
+
+
+class KlineCache:
+
+    def __init__(self, root=KLINE_CACHE_DIR):
+        self.root = root
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _directory(self, symbol, interval):
+        return os.path.join(self.root, symbol, interval)
+
+    # held around every read-modify-write of one (symbol, interval) in this process
+    def _lock(self, symbol, interval):
+        with self._locks_lock:
+            return self._locks.setdefault((symbol, interval), threading.RLock())
+
+    def coverage(self, symbol, interval):
+        path = os.path.join(self._directory(symbol, interval), 'coverage.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_coverage(self, symbol, interval, covered_from, covered_to):
+        directory = self._directory(symbol, interval)
+        temporary = _temporary_path(directory)
+        with open(temporary, 'w') as f:
+            json.dump({'covered_from': int(covered_from), 'covered_to': int(covered_to)}, f)
+        os.replace(temporary, os.path.join(directory, 'coverage.json'))
+
+    # open-time ranges inside [start_ms, end_ms] that still have to be fetched
+    def missing_ranges(self, symbol, interval, start_ms, end_ms):
+        coverage = self.coverage(symbol, interval)
+        if coverage is None:
+            return [(start_ms, end_ms)]
+        ranges = []
+        if start_ms < coverage['covered_from']:
+            ranges.append((start_ms, min(end_ms, coverage['covered_from'] - 1)))
+        if end_ms > coverage['covered_to']:
+            ranges.append((max(start_ms, coverage['covered_to'] + 1), end_ms))
+        return ranges
+
+    # memory-map the segments of every month touching [start_ms, end_ms]
+    def read(self, symbol, interval, start_ms, end_ms):
+        with self._lock(symbol, interval):
+            return self._read(symbol, interval, start_ms, end_ms)
+
+    def _read(self, symbol, interval, start_ms, end_ms):
+        directory = self._directory(symbol, interval)
+        if not os.path.isdir(directory):
+            return pd.DataFrame(columns=CACHE_COLUMNS)
+        first_month, last_month = _month(start_ms), _month(end_ms)
+        tables = []
+        for month in sorted(os.listdir(directory)):
+            if not first_month <= month <= last_month or not os.path.isdir(os.path.join(directory, month)):
+                continue
+            tables.extend(_read_segments(os.path.join(directory, month))[1])
+        if not tables:
+            return pd.DataFrame(columns=CACHE_COLUMNS)
+        df = pa.concat_tables(tables).to_pandas()
+        df = df[(df['timestamp'] >= start_ms) & (df['timestamp'] <= end_ms)]
+        # later segments win when a bar was written twice
+        return df.drop_duplicates(subset='timestamp', keep='last').sort_values('timestamp', ignore_index=True)
+
+    # append closed bars (df may be None when the range had none) and extend the coverage with [covered_from, covered_to], the range has to
+    # touch the existing coverage, otherwise the bars are kept but the coverage stays as it was
+    def write(self, symbol, interval, df, covered_from, covered_to, interval_ms):
+        if covered_to < covered_from:
+            return
+        with self._lock(symbol, interval):
+            self._write(symbol, interval, df, covered_from, covered_to, interval_ms)
+
+    def _write(self, symbol, interval, df, covered_from, covered_to, interval_ms):
+        directory = self._directory(symbol, interval)
+        os.makedirs(directory, exist_ok=True)
+        if df is not None:
+            df = df[(df['timestamp'] >= covered_from) & (df['timestamp'] <= covered_to)]
+
+        if df is not None and not df.empty:
+            months = df['timestamp'].map(_month)
+            for month, part in df.groupby(months):
+                month_directory = os.path.join(directory, month)
+                os.makedirs(month_directory, exist_ok=True)
+                _write_segment(month_directory,
+                               pa.Table.from_pandas(part[CACHE_COLUMNS], schema=CACHE_SCHEMA, preserve_index=False))
+                if len(os.listdir(month_directory)) > MAX_SEGMENTS_PER_MONTH:
+                    self._compact_month(month_directory)
+
+        coverage = self.coverage(symbol, interval)
+        if coverage is None:
+            self._save_coverage(symbol, interval, covered_from, covered_to)
+        elif covered_from <= coverage['covered_to'] + interval_ms and covered_to >= coverage['covered_from'] - interval_ms:
+            self._save_coverage(symbol, interval,
+                                min(covered_from, coverage['covered_from']), max(covered_to, coverage['covered_to']))
+
+    def _compact_month(self, month_directory):
+        segments, tables = _read_segments(month_directory)
+        df = pa.concat_tables(tables).to_pandas()
+        df = df.drop_duplicates(subset='timestamp', keep='last').sort_values('timestamp', ignore_index=True)
+        _write_segment(month_directory, pa.Table.from_pandas(df, schema=CACHE_SCHEMA, preserve_index=False))
+        for segment in segments:
+            os.remove(os.path.join(month_directory, segment))
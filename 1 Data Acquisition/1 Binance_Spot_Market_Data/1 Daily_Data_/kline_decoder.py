@@ -0,0 +1,100 @@
+# decode binance klines responses straight into typed column arrays
+#
+# every page is transposed once and written into preallocated int64/float64 arrays that double when
+# they fill up, the DataFrame is built once per symbol at the end instead of once per page.
+# orjson is used for the JSON parsing when it is installed
+
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+# position of every kept field in a raw kline row
+KLINE_FIELDS = {
+    'timestamp': 0,
+    'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5,
+    'quote_volume': 7,
+    'trades': 8,
+}
+FLOAT_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'quote_volume']
+# nothing is allocated before the first page, fetch_klines_many reserves the planned rows
+# once it knows how many pages a range has
+INITIAL_CAPACITY = 0
+
+
+
+def decode_json(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class KlineColumns:
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.timestamp = np.empty(capacity, dtype='int64')
+        self.trades = np.empty(capacity, dtype='int64')
+        # one (field, row) block for all float fields, the page transposes straight into it
+        self.floats = np.empty((len(FLOAT_FIELDS), capacity), dtype='float64')
+
+    def reserve(self, rows):
+        self._grow(self.size + rows)
+
+    def _grow(self, needed):
+        capacity = len(self.timestamp)
+        if needed <= capacity:
+            return
+        capacity = max(capacity * 2, needed)
+        self.timestamp = np.resize(self.timestamp, capacity)
+        self.trades = np.resize(self.trades, capacity)
+        floats = np.empty((len(FLOAT_FIELDS), capacity), dtype='float64')
+        floats[:, :self.size] = self.floats[:, :self.size]
+        self.floats = floats
+
+    # add one page of raw rows (lists as returned by /api/v3/klines), the pages may come in any order
+    def append(self, rows):
+        if not rows:
+            return
+        n = len(rows)
+        self._grow(self.size + n)
+        fields = list(zip(*rows))
+        end = self.size + n
+        self.timestamp[self.size:end] = fields[KLINE_FIELDS['timestamp']]
+        self.trades[self.size:end] = fields[KLINE_FIELDS['trades']]
+        # numpy parses the price and volume strings itself
+        self.floats[:, self.size:end] = np.array([fields[KLINE_FIELDS[field]] for field in FLOAT_FIELDS], dtype='float64')
+        self.size = end
+
+    # add columns that are already typed (an archive CSV), floats is one (field, row) block
+    def append_arrays(self, timestamp, floats, trades):
+        n = len(timestamp)
+        if not n:
+            return
+        self._grow(self.size + n)
+        end = self.size + n
+        self.timestamp[self.size:end] = timestamp
+        self.trades[self.size:end] = trades
+        self.floats[:, self.size:end] = floats
+        self.size = end
+
+    # one frame in the collector's layout, sorted by timestamp with duplicate bars dropped
+    def to_dataframe(self):
+        order = np.argsort(self.timestamp[:self.size], kind='stable')
+        timestamp = self.timestamp[order]
+        keep = np.ones(len(timestamp), dtype=bool)
+        keep[:-1] = timestamp[1:] != timestamp[:-1]
+        order, timestamp = order[keep], timestamp[keep]
+        df = pd.DataFrame({'timestamp': timestamp})
+        for i, field in enumerate(FLOAT_FIELDS):
+            df[field] = self.floats[i, order]
+        df['trades'] = self.trades[order]
+        df['trade_date'] = pd.to_datetime(df['timestamp'], unit='ms').dt.date
+        return df
@@ -0,0 +1,116 @@
+# per-symbol, per-month digests of the stored klines
+#
+# every checked value is quantized on a log scale whose step is its TOLERANCE_DICT tolerance, so two
+# values in the same bucket are always within tolerance: equal digests mean the month passes the row
+# check, different digests (or a value sitting right on a bucket edge) send the month to the row check.
+# the collector keeps the digests of what it stored in DIGEST_TABLE, the checker computes the same
+# digests from the reference klines and only compares the months that differ row by row
+
+import numpy as np
+import pandas as pd
+
+
+
+# same tolerances (in percent) as the checker's TOLERANCE_DICT
+DIGEST_TOLERANCES = {
+    'close': 0.1,
+    'volume': 2.0,
+    'quote_volume': 2.0,
+    'trades': 2.0,
+}
+
+# symbol VARCHAR, month CHAR(7) 'YYYY-MM', row_count INT, digest BIGINT UNSIGNED, PRIMARY KEY (symbol, month)
+DIGEST_TABLE = '***_month_digest'
+
+# bucket for zero, negative or missing values
+EMPTY_BUCKET = np.iinfo('int64').min
+
+
+
+def month_of(timestamps):
+    months = np.asarray(timestamps, dtype='int64').astype('datetime64[ms]').astype('datetime64[M]')
+    return months.astype(str)
+
+
+def month_range(month):
+    start = pd.Timestamp(month + '-01', tz='UTC')
+    end = start + pd.offsets.MonthBegin(1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000) - 1
+
+
+def quantize(values, tolerance):
+    values = np.asarray(values, dtype=float)
+    step = np.log1p(tolerance / 100)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        buckets = np.floor(np.log(values) / step)
+    return np.where(values > 0, buckets, EMPTY_BUCKET).astype('int64')
+
+
+# DataFrame(month, row_count, digest) for a frame with timestamp and the tolerance columns
+def compute_month_digests(df, tolerances=DIGEST_TOLERANCES):
+    if df.empty:
+        return pd.DataFrame({'month': [], 'row_count': [], 'digest': []})
+    df = df.sort_values('timestamp')
+    quantized = pd.DataFrame({'timestamp': df['timestamp'].to_numpy(dtype='int64')})
+    for column, tolerance in tolerances.items():
+        quantized[column] = quantize(df[column], tolerance)
+    row_hashes = pd.util.hash_pandas_object(quantized, index=False).to_numpy(dtype='uint64')
+
+    # rows are sorted, so every month is one contiguous block; the wrapping uint64 sum of the row
+    # hashes does not depend on order but changes with any added, missing or moved row
+    months = month_of(quantized['timestamp'])
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    digests = np.add.reduceat(row_hashes, starts, dtype='uint64')
+    row_counts = np.diff(np.r_[starts, len(months)])
+    return pd.DataFrame({'month': months[starts], 'row_count': row_counts, 'digest': digests})
+
+
+# months whose digest or row count differ, including months present on one side only
+def mismatching_months(stored, reference):
+    merged = stored.merge(reference, on='month', how='outer', suffixes=('_stored', '_reference'))
+    differs = (merged['row_count_stored'] != merged['row_count_reference']) | \
+              (merged['digest_stored'] != merged['digest_reference'])
+    return sorted(merged.loc[differs, 'month'])
+
+
+# [(first_month, last_month)] blocks of consecutive months, so each block is one range query
+def month_blocks(months):
+    blocks = []
+    for month in sorted(months):
+        previous = (pd.Period(month, 'M') - 1).strftime('%Y-%m')
+        if blocks and blocks[-1][1] == previous:
+            blocks[-1] = (blocks[-1][0], month)
+        else:
+            blocks.append((month, month))
+    return blocks
+
+
+# recompute the digests of every month touched by [start_ts, end_ts] from what is stored now
+def update_month_digests(cursor, symbol, start_ts, end_ts):
+    first_month_start = month_range(month_of([start_ts])[0])[0]
+    last_month_end = month_range(month_of([end_ts])[0])[1]
+    columns = ', '.join(DIGEST_TOLERANCES)
+    cursor.execute(f"""
+        SELECT timestamp, {columns}
+        FROM ***
+        WHERE symbol = %s AND timestamp BETWEEN %s AND %s
+    """, (symbol, first_month_start, last_month_end))
+    rows = cursor.fetchall()
+    df = pd.DataFrame(rows, columns=['timestamp'] + list(DIGEST_TOLERANCES))
+    digests = compute_month_digests(df)
+    if digests.empty:
+        return 0
+    cursor.executemany(f"""
+        INSERT INTO {DIGEST_TABLE} (symbol, month, row_count, digest)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE row_count = VALUES(row_count), digest = VALUES(digest)
+    """, [(symbol, month, int(row_count), int(digest))
+          for month, row_count, digest in digests.itertuples(index=False)])
+    return len(digests)
+
+
+def get_stored_month_digests(cursor, symbol):
+    cursor.execute(f"SELECT month, row_count, digest FROM {DIGEST_TABLE} WHERE symbol = %s", (symbol,))
+    rows = cursor.fetchall()
+    return pd.DataFrame([(month, int(row_count), int(digest)) for month, row_count, digest in rows],
+                        columns=['month', 'row_count', 'digest'])
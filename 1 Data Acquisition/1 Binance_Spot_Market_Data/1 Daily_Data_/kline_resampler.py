@@ -0,0 +1,64 @@
+# derive higher-interval klines from 1m bars locally instead of downloading every interval
+#
+# bars are bucketed by open time (binance aligns every interval to UTC epoch multiples, 1d starts
+# at 00:00 UTC), open/close are the first/last bar of the bucket, high/low the extremes and
+# volume, quote_volume and trades are summed. Minutes the exchange has no bar for (maintenance)
+# are simply absent, like in binance's own higher-interval klines
+
+import numpy as np
+import pandas as pd
+
+from binance_klines_fetcher import INTERVAL_MS
+from indicator_registry import compute_indicators
+
+
+
+SOURCE_INTERVAL = '1m'
+# no 1d: the 1m history starts later than the daily one, so 1d indicators over it (SMA_200, OBV,
+# VWAP, max_drawdown, ...) would be wrong. resample_klines(bars, '1d') still works on its own
+RESAMPLE_INTERVALS = ['5m', '15m', '1h', '4h']
+
+
+
+# bars must be sorted by timestamp; the last bucket is dropped while its period is not over yet
+def resample_klines(bars, interval, source_interval=SOURCE_INTERVAL):
+    interval_ms = INTERVAL_MS[interval]
+    source_ms = INTERVAL_MS[source_interval]
+    if bars.empty:
+        return bars.iloc[:0]
+    timestamp = bars['timestamp'].to_numpy(dtype='int64')
+    buckets = timestamp - timestamp % interval_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    last = np.r_[starts[1:], len(buckets)] - 1
+
+    df = pd.DataFrame({
+        'timestamp': buckets[starts],
+        'open': bars['open'].to_numpy(dtype=float)[starts],
+        'high': np.maximum.reduceat(bars['high'].to_numpy(dtype=float), starts),
+        'low': np.minimum.reduceat(bars['low'].to_numpy(dtype=float), starts),
+        'close': bars['close'].to_numpy(dtype=float)[last],
+        'volume': np.add.reduceat(bars['volume'].to_numpy(dtype=float), starts),
+        'quote_volume': np.add.reduceat(bars['quote_volume'].to_numpy(dtype=float), starts),
+        'trades': np.add.reduceat(bars['trades'].to_numpy(dtype='int64'), starts),
+    })
+    if timestamp[-1] + source_ms < buckets[-1] + interval_ms:
+        df = df.iloc[:-1]
+    df['trade_date'] = pd.to_datetime(df['timestamp'], unit='ms').dt.date
+    return df
+
+
+# {interval: bars} for the source interval and every resampled one
+def resample_all(bars, intervals=RESAMPLE_INTERVALS, source_interval=SOURCE_INTERVAL):
+    frames = {source_interval: bars}
+    for interval in intervals:
+        frames[interval] = resample_klines(bars, interval, source_interval)
+    return frames
+
+
+# one symbol's 1m bars -> {interval: bars with the full indicator set}, the signature of a pipeline stage
+def calculate_interval_indicators(symbol, bars):
+    result = {}
+    for interval, frame in resample_all(bars).items():
+        if not frame.empty:
+            result[interval] = compute_indicators(frame.reset_index(drop=True))
+    return result
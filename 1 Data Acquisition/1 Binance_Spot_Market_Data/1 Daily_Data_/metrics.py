@@ -0,0 +1,287 @@
+# in-process metrics for the collector and the checker
+#
+# timing histograms (HTTP requests, indicator passes, DB batches, pipeline stages), counters (rows
+# fetched/written, rate-limit waits) and max gauges (used weight) live in one registry. Every timing
+# taken while a symbol is current (`with metrics.symbol(...)`) is also added to that symbol's
+# breakdown; the breakdown is per metric, nested timings (a stage and its HTTP requests) overlap.
+# an observation is a lock, a bisect and a few additions, cheap enough to stay on in production;
+# METRICS_ENABLED=0 turns every call into a no-op.
+#
+# snapshots go to pluggable sinks (JsonLinesSink appends one JSON line per flush), serve_prometheus
+# exposes the live registry in the Prometheus text format. PROFILE_SYMBOL=BTCUSDT runs cProfile
+# while that symbol is current in the calling thread and writes {PROFILE_DIR}/profile_BTCUSDT.prof
+
+import bisect
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+METRICS_FILE = os.getenv('METRICS_FILE', 'metrics.jsonl')
+# 0 leaves the Prometheus endpoint off
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# seconds between snapshots written by a running collection, 0 writes only the final one
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '60'))
+PROFILE_SYMBOL = os.getenv('PROFILE_SYMBOL')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '.')
+
+# upper bounds in seconds, from one fast HTTP round trip to a throttled minute
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # cumulative counts per upper bound like Prometheus, the last one is +Inf
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + [float('inf')], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}={value}' for label, value in labels) + '}'
+
+
+class Metrics:
+
+    def __init__(self, enabled=METRICS_ENABLED, profile_symbol=PROFILE_SYMBOL, profile_dir=PROFILE_DIR):
+        self.enabled = enabled
+        self.profile_symbol = profile_symbol
+        self.profile_dir = profile_dir
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # {symbol: {metric: seconds}}
+        self.symbols = {}
+        self.sinks = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile = None
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # gauge that only ever goes up during a run, e.g. the used-weight peak
+    def set_max(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = max(self.gauges.get(key, value), value)
+
+    def observe(self, name, seconds, symbol=None, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        symbol = symbol or getattr(self._local, 'symbol', None)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+            if symbol is not None:
+                breakdown = self.symbols.setdefault(symbol, {})
+                metric = ':'.join([name] + [str(value) for _, value in key[1]])
+                breakdown[metric] = breakdown.get(metric, 0.0) + seconds
+
+    @contextmanager
+    def _timer(self, name, symbol, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, symbol, **labels)
+
+    def timer(self, name, symbol=None, **labels):
+        if not self.enabled:
+            return nullcontext()
+        return self._timer(name, symbol, labels)
+
+    # make `symbol` current in this thread, timings without an explicit symbol are attributed to it
+    @contextmanager
+    def symbol(self, symbol):
+        previous = getattr(self._local, 'symbol', None)
+        self._local.symbol = symbol
+        profiling = self.enabled and symbol == self.profile_symbol and self._start_profile()
+        try:
+            yield
+        finally:
+            if profiling:
+                self._stop_profile(symbol)
+            self._local.symbol = previous
+
+    def _start_profile(self):
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError as e:
+            logging.warning(f"⚠️ cProfile is busy, {self.profile_symbol} not profiled here : {e}")
+            return False
+        return True
+
+    def _stop_profile(self, symbol):
+        self._profile.disable()
+        path = os.path.join(self.profile_dir, f'profile_{symbol}.prof')
+        self._profile.dump_stats(path)
+        logging.info(f"🔬 {symbol} profile written to {path}")
+
+    def snapshot(self, run=None):
+        with self._lock:
+            return {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'run': run,
+                'counters': {_format_key(key): value for key, value in self.counters.items()},
+                'gauges': {_format_key(key): value for key, value in self.gauges.items()},
+                'histograms': {_format_key(key): {
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 6),
+                    'max': round(histogram.max, 6),
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+                } for key, histogram in self.histograms.items()},
+                'symbols': {symbol: {metric: round(seconds, 6) for metric, seconds in breakdown.items()}
+                            for symbol, breakdown in self.symbols.items()},
+            }
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def flush(self, run=None):
+        if not self.enabled or not self.sinks:
+            return
+        snapshot = self.snapshot(run)
+        for sink in self.sinks:
+            try:
+                sink.write(snapshot)
+            except OSError as e:
+                logging.error(f"❌ metrics sink {type(sink).__name__} failed : {e}")
+
+    # flush every `interval` seconds until the returned event is set
+    def flush_periodically(self, run=None, interval=METRICS_FLUSH_SECONDS):
+        stop = threading.Event()
+        if interval > 0:
+            def loop():
+                while not stop.wait(interval):
+                    self.flush(run)
+            threading.Thread(target=loop, name='metrics-flush', daemon=True).start()
+        return stop
+
+    # the registry in the Prometheus text exposition format
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({key[0] for key in series}):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines += [f'{name}{_prometheus_labels(labels)} {value}'
+                              for (n, labels), value in series.items() if n == name]
+            for name in sorted({key[0] for key in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (n, labels), histogram in self.histograms.items():
+                    if n != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else str(bound)
+                        lines.append(f'{name}_bucket{_prometheus_labels(labels + (("le", le),))} {count}')
+                    lines.append(f'{name}_sum{_prometheus_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_prometheus_labels(labels)} {histogram.count}')
+            if self.symbols:
+                lines.append('# TYPE symbol_seconds gauge')
+                for symbol, breakdown in self.symbols.items():
+                    lines += [f'symbol_seconds{_prometheus_labels((("metric", metric), ("symbol", symbol)))} {seconds}'
+                              for metric, seconds in breakdown.items()]
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+# appends every snapshot as one JSON line
+class JsonLinesSink:
+
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, snapshot):
+        line = json.dumps(snapshot, default=str)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+# GET /metrics on `port` from a daemon thread, returns the server (server.shutdown() stops it)
+def serve_prometheus(registry, port=METRICS_PORT):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"📈 metrics on http://localhost:{server.server_address[1]}/metrics")
+    return server
+
+
+# one registry per process, shared like the fetcher's limiter
+metrics = Metrics()
+
+
+# sinks from the environment: METRICS_FILE always, the endpoint when METRICS_PORT is set
+def configure_from_env(registry=metrics):
+    if not registry.enabled:
+        return
+    if METRICS_FILE:
+        registry.add_sink(JsonLinesSink(METRICS_FILE))
+    if METRICS_PORT:
+        serve_prometheus(registry, METRICS_PORT)
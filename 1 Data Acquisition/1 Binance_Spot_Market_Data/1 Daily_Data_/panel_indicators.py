@@ -0,0 +1,158 @@
+# vectorized calculate_financial_indicators over a time x symbol panel
+# every indicator is one numpy pass over all symbols instead of one pandas call per symbol
+
+import numpy as np
+import pandas as pd
+
+from indicator_registry import INDICATOR_COLUMNS, INDICATOR_DTYPE, SMA_EMA_PERIODS, VOLUME_MA_PERIODS
+from metrics import metrics
+
+
+
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+
+# align per-symbol kline frames on the union of their timestamps, missing bars are NaN
+def build_price_panel(frames):
+    frames = {symbol: df for symbol, df in frames.items() if df is not None and not df.empty}
+    symbols = list(frames)
+    timestamps = np.unique(np.concatenate([df['timestamp'].to_numpy(dtype='int64') for df in frames.values()])) \
+        if frames else np.empty(0, dtype='int64')
+
+    panel = {field: np.full((len(timestamps), len(symbols)), np.nan) for field in PANEL_FIELDS}
+    rows = {}
+    for j, symbol in enumerate(symbols):
+        df = frames[symbol]
+        rows[symbol] = np.searchsorted(timestamps, df['timestamp'].to_numpy(dtype='int64'))
+        for field in PANEL_FIELDS:
+            panel[field][rows[symbol], j] = df[field].to_numpy(dtype=float)
+
+    return {'timestamps': timestamps, 'symbols': symbols, 'rows': rows, **panel}
+
+
+# the per-symbol function sees each series without holes, so pack every column's bars against the
+# end of the panel (leading NaN only) before computing and scatter the results back afterwards
+def _pack(panel):
+    length = max((len(r) for r in panel['rows'].values()), default=0)
+    packed = {field: np.full((length, len(panel['symbols'])), np.nan) for field in PANEL_FIELDS}
+    for j, symbol in enumerate(panel['symbols']):
+        rows = panel['rows'][symbol]
+        for field in PANEL_FIELDS:
+            packed[field][length - len(rows):, j] = panel[field][rows, j]
+    return packed
+
+
+def _unpack(panel, packed_values):
+    values = np.full((len(panel['timestamps']), len(panel['symbols'])), np.nan)
+    length = len(packed_values)
+    for j, symbol in enumerate(panel['symbols']):
+        rows = panel['rows'][symbol]
+        values[rows, j] = packed_values[length - len(rows):, j]
+    return values
+
+
+
+def _shift(values, periods=1):
+    shifted = np.full_like(values, np.nan)
+    shifted[periods:] = values[:-periods]
+    return shifted
+
+
+# rolling(window, min_periods=window) over the whole time x symbol block in one pandas call, a
+# window that touches a NaN is NaN. The cost is O(T x S) whatever the window
+def _rolling(values, window, how):
+    return getattr(pd.DataFrame(values).rolling(window), how)().to_numpy()
+
+
+# ewm(alpha, adjust=False, min_periods) per column for several alphas, starting at the first
+# non-NaN value. Inputs only have leading NaNs (see _pack), so the pandas recursion over the block
+# is the same as the per-symbol one
+def _ewm(values, alphas, min_periods):
+    frame = pd.DataFrame(values)
+    return [frame.ewm(alpha=alpha, adjust=False, min_periods=periods).mean().to_numpy()
+            for alpha, periods in zip(alphas, min_periods)]
+
+
+# cumulative sum that stays NaN before the first bar of each symbol
+def _cumsum(values, started):
+    return np.where(started, np.nancumsum(values, axis=0), np.nan)
+
+
+
+# compute every indicator column for all symbols, returns {column: time x symbol array}
+def calculate_panel_indicators(panel):
+    packed = _pack(panel)
+    high, low, close, volume = packed['high'], packed['low'], packed['close'], packed['volume']
+    started = np.maximum.accumulate(~np.isnan(close), axis=0)
+    previous_close = _shift(close)
+    result = {}
+
+    # SMA and EMA, the MACD EMAs share the same pass over close
+    emas = _ewm(close, [2 / (period + 1) for period in SMA_EMA_PERIODS] + [2 / 13, 2 / 27],
+                SMA_EMA_PERIODS + [0, 0])
+    for period, ema in zip(SMA_EMA_PERIODS, emas):
+        result[f'SMA_{period}'] = _rolling(close, period, 'mean')
+        result[f'EMA_{period}'] = ema
+
+    # volume moving averages
+    for period in VOLUME_MA_PERIODS:
+        result[f'volume_MA_{period}'] = _rolling(volume, period, 'mean')
+
+    # RSI
+    delta = close - previous_close
+    gain = _rolling(np.where(np.isnan(delta), np.nan, np.maximum(delta, 0)), 14, 'mean')
+    loss = _rolling(np.where(np.isnan(delta), np.nan, -np.minimum(delta, 0)), 14, 'mean')
+    rs = gain / (loss + 1e-10)
+    result['RSI_14'] = 100 - (100 / (1 + rs))
+
+    # VWAP
+    typical_price = (high + low + close) / 3
+    result['VWAP'] = _cumsum(typical_price * volume, started) / _cumsum(volume, started)
+
+    # OBV
+    result['OBV'] = _cumsum(np.nan_to_num(np.sign(delta) * volume), started)
+
+    # MACD
+    result['MACD'] = emas[-2] - emas[-1]
+    result['MACD_single'], = _ewm(result['MACD'], [2 / 10], [0])
+
+    # KDJ
+    lowest_low = _rolling(low, 14, 'min')
+    highest_high = _rolling(high, 14, 'max')
+    rsv = (close - lowest_low) / (highest_high - lowest_low + 1e-10) * 100
+    result['K'], = _ewm(rsv, [1 / 3], [14])
+    result['D'], = _ewm(result['K'], [1 / 3], [14])
+    result['J'] = 3 * result['K'] - 2 * result['D']
+
+    # ATR
+    true_range = np.fmax(np.fmax(high - low, np.abs(high - previous_close)), np.abs(low - previous_close))
+    result['ATR'] = _rolling(true_range, 14, 'mean')
+
+    # Bollinger bands
+    rolling_std = _rolling(close, 20, 'std')
+    result['bollinger_middle'] = result['SMA_20']
+    result['bollinger_upper'] = result['SMA_20'] + rolling_std * 2
+    result['bollinger_lower'] = result['SMA_20'] - rolling_std * 2
+
+    # max drawdown and sharpe ratio
+    result['max_drawdown'] = close / np.fmax.accumulate(close, axis=0) - 1
+    returns = close / previous_close - 1
+    result['sharpe_ratio'] = _rolling(returns, 20, 'mean') / (_rolling(returns, 20, 'std') + 1e-10)
+
+    return {column: _unpack(panel, result[column]) for column in INDICATOR_COLUMNS}
+
+
+# per-symbol frames with the same typed indicator columns as calculate_financial_indicators
+def calculate_indicators_for_frames(frames, dtype=INDICATOR_DTYPE):
+    panel = build_price_panel(frames)
+    with metrics.timer('indicator_seconds', engine='panel'):
+        indicators = calculate_panel_indicators(panel)
+    result = {}
+    for j, symbol in enumerate(panel['symbols']):
+        rows = panel['rows'][symbol]
+        values = np.column_stack([indicators[column][rows, j] for column in INDICATOR_COLUMNS]).astype(dtype, copy=False)
+        df = pd.concat([frames[symbol], pd.DataFrame(values, columns=INDICATOR_COLUMNS, index=frames[symbol].index)],
+                       axis=1)
+        result[symbol] = df
+    return result
@@ -0,0 +1,292 @@
+# research read API: stored klines and indicators as aligned time x symbol numpy panels
+#
+# load_panel(symbols, columns, start, end) returns the same layout as panel_indicators'
+# build_price_panel: {'timestamps', 'symbols', column: (time x symbol) array}, NaN where a symbol
+# has no bar or the value is NULL. Symbols are read in batches, one multi-symbol query per batch
+# on a pooled connection, streamed with a server-side cursor into preallocated arrays.
+#
+# every symbol's stored history (from its first bar) is kept in a local memory-mapped cache, one
+# raw column file per column plus meta.json. A load first asks the database for each symbol's last
+# timestamp, row count and sum of row_hash: when they match the cache nothing is read, otherwise
+# only the bars from the last cached one on (it may have been stored while still open) are read and
+# appended. If the row count or the hash sum still does not add up, older rows were inserted or
+# rewritten in place (gap repair, its cumulative tail update) and the symbol is read again in full.
+# rows without a row_hash (written before it existed) count 0, refresh=True rereads everything
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pymysql
+from dbutils.pooled_db import PooledDB
+from dotenv import load_dotenv
+
+from binance_klines_fetcher import to_milliseconds
+from database_reader import stream_columns
+from database_writer import INSERT_COLUMNS, INTERVAL_TABLES
+from metrics import metrics
+
+
+
+PANEL_CACHE_DIR = os.getenv('PANEL_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'panel_cache'))
+# symbols per query and queries in flight, one pooled connection each
+LOAD_BATCH_SYMBOLS = 25
+LOAD_WORKERS = 4
+# every stored value column can be loaded
+LOADABLE_COLUMNS = [column for column in INSERT_COLUMNS if column not in ('symbol', 'timestamp', 'trade_date', 'row_hash')]
+
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        load_dotenv()
+        _pool = PooledDB(
+            creator=pymysql,
+            maxconnections=LOAD_WORKERS,
+            blocking=True,
+            host=os.getenv('***'),
+            user=os.getenv('***'),
+            password=os.getenv('***'),
+            database=os.getenv('***'),
+            charset='utf8',
+            autocommit=True
+        )
+    return _pool
+
+
+# exact sum of uint64 hashes (up to 2**32 rows), as SUM(row_hash) returns it
+def hash_sum(hashes):
+    hashes = np.asarray(hashes, dtype='uint64')
+    return (int((hashes >> np.uint64(32)).sum()) << 32) + int((hashes & np.uint64(0xFFFFFFFF)).sum())
+
+
+# one symbol's cached history: timestamp.i64, {column}.f64 and meta.json with the row count, the
+# row_hash sum and the last row's hash
+class SymbolCache:
+
+    def __init__(self, root, interval, symbol):
+        self.directory = os.path.join(root, interval, symbol)
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+
+    def _path(self, column):
+        return os.path.join(self.directory, 'timestamp.i64' if column == 'timestamp' else f'{column}.f64')
+
+    @property
+    def rows(self):
+        return self.meta['rows'] if self.meta else 0
+
+    @property
+    def last_timestamp(self):
+        return self.meta['last_timestamp'] if self.meta else None
+
+    @property
+    def hash_sum(self):
+        return self.meta.get('hash_sum') if self.meta else None
+
+    # an incremental read needs the last row, its hash leaves the sum when it is read again
+    @property
+    def extendable(self):
+        return self.last_timestamp is not None and self.meta.get('last_hash') is not None
+
+    def has_columns(self, columns):
+        return self.meta is not None and set(columns) <= set(self.meta['columns'])
+
+    def read(self, column):
+        if not self.rows:
+            return np.empty(0, dtype='int64' if column == 'timestamp' else 'float64')
+        dtype = 'int64' if column == 'timestamp' else 'float64'
+        return np.memmap(self._path(column), dtype=dtype, mode='r', shape=(self.rows,))
+
+    def _save_meta(self, meta):
+        temporary = self.meta_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temporary, self.meta_path)
+        self.meta = meta
+
+    # keep the first `keep` rows, 0 or all but the last one, and append `arrays` (with row_hash).
+    # Before rows are cut meta.json drops the last timestamp (a crash then means a full read next
+    # time), it is replaced last, so the files are never shorter than the row count it records
+    def write(self, keep, arrays, columns):
+        os.makedirs(self.directory, exist_ok=True)
+        kept_hash_sum = self.meta['hash_sum'] - self.meta['last_hash'] if keep else 0
+        if self.meta and keep < self.rows:
+            self._save_meta({'rows': keep, 'last_timestamp': None, 'columns': self.meta['columns']})
+        for column in ['timestamp'] + columns:
+            # append mode writes at the end, which the truncate just moved to row `keep`
+            with open(self._path(column), 'ab') as f:
+                f.truncate(keep * 8)
+                f.write(np.ascontiguousarray(arrays[column]).tobytes())
+        rows = keep + len(arrays['timestamp'])
+        # without a new last row the next load reads the symbol in full
+        last_timestamp = int(arrays['timestamp'][-1]) if len(arrays['timestamp']) else None
+        last_hash = int(arrays['row_hash'][-1]) if len(arrays['row_hash']) else None
+        self._save_meta({'rows': rows, 'last_timestamp': last_timestamp, 'columns': columns,
+                         'hash_sum': kept_hash_sum + hash_sum(arrays['row_hash']), 'last_hash': last_hash})
+
+
+# {symbol: (last_timestamp, row_count, row_hash sum)} of the stored symbols in one grouped query,
+# the sum changes with every rewrite that changes a row's content (or clears its hash)
+def get_stored_extent(symbols, table, pool):
+    # no symbols would be `IN ()`, which MySQL rejects
+    if not symbols:
+        return {}
+    connection = pool.connection()
+    try:
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(symbols))
+            cursor.execute(f"""
+                SELECT symbol, MAX(timestamp), COUNT(*), COALESCE(SUM(row_hash), 0)
+                FROM {table}
+                WHERE symbol IN ({placeholders})
+                GROUP BY symbol
+            """, tuple(symbols))
+            return {row[0]: (int(row[1]), int(row[2]), int(row[3])) for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+
+# {symbol: {column: array}} of the bars from since[symbol] (to `until`), one streamed query for the
+# batch; with_hash adds each row's row_hash (NULL as 0) for the cache
+def read_batch(since, columns, table, pool, expected_rows=0, until=None, with_hash=False):
+    if not since:
+        return {}
+    names = ['timestamp'] + columns + (['row_hash'] if with_hash else [])
+    conditions = ' OR '.join(['(symbol = %s AND timestamp >= %s)'] * len(since))
+    params = tuple(value for symbol, start in since.items() for value in (symbol, start))
+    if until is not None:
+        conditions = f'({conditions}) AND timestamp <= %s'
+        params += (until,)
+    connection = pool.connection()
+    try:
+        with metrics.timer('panel_read_seconds', table=table):
+            arrays = stream_columns(connection, f"""
+                SELECT symbol, timestamp, {', '.join(columns)}{', COALESCE(row_hash, 0)' if with_hash else ''}
+                FROM {table}
+                WHERE {conditions}
+                ORDER BY symbol, timestamp
+            """, params, ['object', 'int64'] + ['float64'] * len(columns) + (['uint64'] if with_hash else []),
+                expected_rows)
+    finally:
+        connection.close()
+
+    symbol_values, result = arrays[0], {}
+    starts = np.flatnonzero(np.r_[True, symbol_values[1:] != symbol_values[:-1]]) if len(symbol_values) else []
+    ends = np.r_[starts[1:], len(symbol_values)] if len(symbol_values) else []
+    for start, end in zip(starts, ends):
+        result[symbol_values[start]] = {name: array[start:end] for name, array in zip(names, arrays[1:])}
+    metrics.count('panel_rows_read_total', len(symbol_values), table=table)
+    return result
+
+
+# symbols grouped by the columns they hold, LOAD_BATCH_SYMBOLS per batch
+def make_batches(plans):
+    groups = {}
+    for symbol, (_, _, held) in plans.items():
+        groups.setdefault(tuple(held), []).append(symbol)
+    return [symbols[i:i + LOAD_BATCH_SYMBOLS] for symbols in groups.values() for i in range(0, len(symbols), LOAD_BATCH_SYMBOLS)]
+
+
+# bring the cache of `symbols` up to the stored extent, returns {symbol: SymbolCache}
+def sync_cache(symbols, columns, table, interval, pool, root=PANEL_CACHE_DIR, refresh=False):
+    extent = get_stored_extent(symbols, table, pool)
+    caches = {symbol: SymbolCache(root, interval, symbol) for symbol in symbols if symbol in extent}
+
+    # {symbol: (first timestamp to read, rows kept from the cache, columns to hold)}
+    plans = {}
+    for symbol, cache in caches.items():
+        if not refresh and cache.has_columns(columns) and (cache.last_timestamp, cache.rows, cache.hash_sum) == extent[symbol]:
+            continue
+        if refresh or not cache.has_columns(columns) or not cache.extendable:
+            held = sorted(set(columns) | set(cache.meta['columns'] if cache.meta and not refresh else []))
+            plans[symbol] = (0, 0, held)
+        else:
+            # the last cached bar is read again, it may have been stored while still open
+            plans[symbol] = (cache.last_timestamp, cache.rows - 1, cache.meta['columns'])
+
+    # symbols of one batch hold the same columns, those are the columns of its query
+    def load(batch):
+        held = list(plans[batch[0]][2])
+        expected = sum(extent[symbol][1] - plans[symbol][1] for symbol in batch)
+        fetched = read_batch({symbol: plans[symbol][0] for symbol in batch}, held, table, pool, expected, with_hash=True)
+        reload = []
+        for symbol in batch:
+            keep = plans[symbol][1]
+            arrays = fetched.get(symbol, {'timestamp': np.empty(0, dtype='int64'), 'row_hash': np.empty(0, dtype='uint64'),
+                                          **{column: np.empty(0) for column in held}})
+            caches[symbol].write(keep, arrays, held)
+            if keep and (caches[symbol].rows, caches[symbol].hash_sum) != extent[symbol][1:]:
+                reload.append(symbol)
+        return reload
+
+    batches = make_batches(plans)
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        reload = [symbol for symbols_to_reload in executor.map(load, batches) for symbol in symbols_to_reload]
+    if reload:
+        logging.warning(f"⚠️ {len(reload)} symbols changed before their last cached bar, reading them again")
+        for symbol in reload:
+            plans[symbol] = (0, 0, caches[symbol].meta['columns'])
+        for batch in make_batches({symbol: plans[symbol] for symbol in reload}):
+            load(batch)
+    logging.info(f"✅ panel cache: {len(caches) - len(plans)} symbols up to date, {len(plans)} read from the database")
+    return caches
+
+
+# {'timestamps', 'symbols', column: (time x symbol) array} over [start, end] (open times, inclusive)
+def load_panel(symbols, columns, start=None, end=None, interval='1d', use_cache=True, refresh=False,
+               root=PANEL_CACHE_DIR, pool=None, dtype='float64'):
+    columns = list(columns)
+    unknown = [column for column in columns if column not in LOADABLE_COLUMNS]
+    if unknown:
+        raise KeyError(f"not stored columns : {unknown}")
+    table = INTERVAL_TABLES[interval]
+    pool = pool or get_pool()
+    start_ms = to_milliseconds(start) if start is not None else None
+    end_ms = to_milliseconds(end) if end is not None else None
+    symbols = list(symbols)
+    if not symbols:
+        return {'timestamps': np.empty(0, dtype='int64'), 'symbols': [],
+                **{column: np.empty((0, 0), dtype=dtype) for column in columns}}
+
+    with metrics.timer('panel_load_seconds', interval=interval):
+        if use_cache:
+            caches = sync_cache(symbols, columns, table, interval, pool, root, refresh)
+            sources = {symbol: {column: cache.read(column) for column in ['timestamp'] + columns}
+                       for symbol, cache in caches.items()}
+        else:
+            sources = {}
+            for i in range(0, len(symbols), LOAD_BATCH_SYMBOLS):
+                sources.update(read_batch(dict.fromkeys(symbols[i:i + LOAD_BATCH_SYMBOLS], start_ms or 0),
+                                          columns, table, pool, until=end_ms))
+
+        # slice every symbol to [start, end] before aligning
+        ranges = {}
+        for symbol, source in sources.items():
+            timestamp = source['timestamp']
+            lower = np.searchsorted(timestamp, start_ms, 'left') if start_ms is not None else 0
+            upper = np.searchsorted(timestamp, end_ms, 'right') if end_ms is not None else len(timestamp)
+            ranges[symbol] = (lower, upper)
+        timestamps = np.unique(np.concatenate([sources[s]['timestamp'][lower:upper] for s, (lower, upper) in ranges.items()])) \
+            if ranges else np.empty(0, dtype='int64')
+
+        panel = {'timestamps': timestamps, 'symbols': symbols}
+        for column in columns:
+            panel[column] = np.full((len(timestamps), len(symbols)), np.nan, dtype=dtype)
+        for j, symbol in enumerate(symbols):
+            if symbol not in ranges:
+                continue
+            lower, upper = ranges[symbol]
+            rows = np.searchsorted(timestamps, sources[symbol]['timestamp'][lower:upper])
+            for column in columns:
+                panel[column][rows, j] = sources[symbol][column][lower:upper]
+    return panel
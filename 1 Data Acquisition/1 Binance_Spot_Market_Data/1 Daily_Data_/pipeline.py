@@ -0,0 +1,176 @@
+# staged fetch -> compute -> store execution
+#
+# every stage has a bounded input queue and its own workers; a worker blocks on put() while the
+# next queue is full, so a slow stage holds back the ones before it instead of piling up frames in
+# memory. Thread stages run the function in the worker thread (I/O: HTTP, MySQL), process stages
+# hand it to a process pool (CPU: pandas/numpy), the function then has to be importable from a
+# side-effect-free module. The pool's processes come from a fork server that started before any of
+# our threads, so none of them inherits a lock (metrics, rate limiter) held by another thread at
+# fork time. A run takes about as long as its slowest stage instead of the sum.
+# A batch stage collects up to `batch` symbols and calls its function once for all of them.
+
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import metrics
+
+
+
+QUEUE_SIZE = 16
+# seconds between queue depth samples
+SAMPLE_INTERVAL = 0.5
+
+_DONE = object()
+
+
+
+class Stage:
+
+    # function(symbol, payload) -> payload for the next stage, or None to drop the symbol;
+    # with batch set, function({symbol: payload}) -> {symbol: payload}, symbols missing from it are dropped
+    def __init__(self, name, function, workers, processes=False, batch=None):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.processes = processes
+        self.batch = batch
+        self.items = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.first_started = None
+        self.last_finished = None
+        self.depth_samples = []
+        self.lock = threading.Lock()
+
+    def record(self, started, finished, ok, count=1):
+        with self.lock:
+            self.items += count if ok else 0
+            self.failed += 0 if ok else count
+            self.busy_seconds += finished - started
+            self.first_started = started if self.first_started is None else min(self.first_started, started)
+            self.last_finished = finished if self.last_finished is None else max(self.last_finished, finished)
+
+    def stats(self):
+        active = (self.last_finished - self.first_started) if self.items + self.failed else 0.0
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'failed': self.failed,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'active_seconds': round(active, 3),
+            'items_per_second': round(self.items / active, 3) if active else 0.0,
+            # fraction of the workers' time spent in the function, near 1 marks the bottleneck
+            'utilization': round(self.busy_seconds / (active * self.workers), 3) if active else 0.0,
+            'queue_depth_mean': round(sum(self.depth_samples) / len(self.depth_samples), 2) if self.depth_samples else 0.0,
+            'queue_depth_max': max(self.depth_samples, default=0),
+        }
+
+
+def _worker(stage, inbox, outbox, executor):
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            return
+        symbol, payload = item
+        started = time.perf_counter()
+        try:
+            # process stages are timed here in the parent, their own metrics stay in the child
+            with metrics.symbol(symbol), metrics.timer('stage_seconds', stage=stage.name):
+                if executor is not None:
+                    result = executor.submit(stage.function, symbol, payload).result()
+                else:
+                    result = stage.function(symbol, payload)
+        except Exception as e:
+            stage.record(started, time.perf_counter(), False)
+            logging.error(f"❌ {symbol} failed in {stage.name} : {e}")
+            continue
+        stage.record(started, time.perf_counter(), True)
+        if result is not None and outbox is not None:
+            outbox.put((symbol, result))
+
+
+# waits until the batch is full (or the stage is shutting down) so every call gets `batch` symbols
+def _batch_worker(stage, inbox, outbox, executor):
+    done = False
+    while not done:
+        batch = {}
+        while len(batch) < stage.batch:
+            item = inbox.get()
+            if item is _DONE:
+                done = True
+                break
+            symbol, payload = item
+            batch[symbol] = payload
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            with metrics.timer('stage_seconds', stage=stage.name):
+                if executor is not None:
+                    results = executor.submit(stage.function, batch).result()
+                else:
+                    results = stage.function(batch)
+        except Exception as e:
+            stage.record(started, time.perf_counter(), False, len(batch))
+            logging.error(f"❌ {len(batch)} symbols ({', '.join(batch)}) failed in {stage.name} : {e}")
+            continue
+        stage.record(started, time.perf_counter(), True, len(batch))
+        if outbox is not None:
+            for symbol, result in results.items():
+                if result is not None:
+                    outbox.put((symbol, result))
+
+
+def _sample_depths(stages, queues, stop):
+    while not stop.wait(SAMPLE_INTERVAL):
+        for stage, inbox in zip(stages, queues):
+            stage.depth_samples.append(inbox.qsize())
+
+
+# feed {symbol: payload} through the stages, returns {stage name: stats} and the run's wall time
+def run_pipeline(items, stages, queue_size=QUEUE_SIZE):
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    executors = [ProcessPoolExecutor(max_workers=stage.workers, mp_context=multiprocessing.get_context('forkserver'))
+                 if stage.processes else None for stage in stages]
+    started = time.perf_counter()
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_depths, args=(stages, queues, stop), daemon=True)
+    sampler.start()
+
+    threads = []
+    for i, stage in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        threads.append([threading.Thread(target=_batch_worker if stage.batch else _worker, args=(stage, queues[i], outbox, executors[i]),
+                                         name=f'{stage.name}-{n}', daemon=True)
+                        for n in range(stage.workers)])
+    for stage_threads in threads:
+        for thread in stage_threads:
+            thread.start()
+
+    try:
+        for symbol, payload in items.items():
+            queues[0].put((symbol, payload))
+        # shut the stages down front to back once everything before them has drained
+        for i, stage_threads in enumerate(threads):
+            for _ in stage_threads:
+                queues[i].put(_DONE)
+            for thread in stage_threads:
+                thread.join()
+    finally:
+        stop.set()
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    report = {'elapsed_seconds': round(elapsed, 3), 'stages': {stage.name: stage.stats() for stage in stages}}
+    for name, stats in report['stages'].items():
+        logging.info(f"📊 {name}: {stats['items']} done, {stats['failed']} failed, "
+                     f"{stats['items_per_second']}/s, utilization {stats['utilization']}, "
+                     f"queue depth mean {stats['queue_depth_mean']} max {stats['queue_depth_max']}")
+    logging.info(f"📋 pipeline finished in {report['elapsed_seconds']}s")
+    return report
@@ -0,0 +1,97 @@
+# universe screening for get_aim_symbols
+#
+# both selection stages (mean quote volume over 14 days -> top 200, then over 30 days -> top 100)
+# are ranked from one 30-day download per symbol; an optional bulk /ticker/24hr request drops
+# symbols with negligible volume before any klines are requested. A cached ranking can be
+# refreshed cheaply by re-scoring only the symbols around the top-100 cutoff
+
+import logging
+
+import pandas as pd
+import requests
+
+from binance_klines_fetcher import fetch_klines_many, get_24h_quote_volumes, server_clock
+
+
+
+SHORT_WINDOW_DAYS = 14
+LONG_WINDOW_DAYS = 30
+SHORT_TOP = 200
+LONG_TOP = 100
+# symbols kept by the 24h ticker pre-filter, generously above SHORT_TOP so a symbol with one
+# quiet day still makes it into the 14-day ranking
+TICKER_PREFILTER_TOP = 600
+# ranks on either side of LONG_TOP that are re-scored by rescore_near_cutoff
+NEAR_CUTOFF_MARGIN = 30
+
+
+
+# the window starts at 00:00 UTC `days` days before now, like the date strings used before
+def window_start_ms(now_ms, days):
+    start = pd.Timestamp(now_ms, unit='ms', tz='UTC').normalize() - pd.Timedelta(days=days)
+    return int(start.timestamp() * 1000)
+
+
+# {symbol: mean quote volume of the bars opened at or after start_ms}
+def mean_quote_volumes(klines, start_ms):
+    means = {}
+    for symbol, df in klines.items():
+        if df is None or df.empty:
+            continue
+        quote_volume = df['quote_volume'].to_numpy(dtype=float)[df['timestamp'].to_numpy() >= start_ms]
+        if len(quote_volume):
+            means[symbol] = quote_volume.mean()
+    return means
+
+
+def top_symbols(scores, top):
+    return [symbol for symbol, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top]]
+
+
+def prefilter_by_ticker(symbols, quote_volumes, top=TICKER_PREFILTER_TOP):
+    ranked = top_symbols({symbol: quote_volumes.get(symbol, 0.0) for symbol in symbols}, top)
+    logging.info(f"✅ 24h ticker pre-filter kept {len(ranked)} of {len(symbols)} symbols")
+    return ranked
+
+
+# 30-day mean quote volume of the 14-day shortlist, from klines already in memory
+def score_symbols(klines, now_ms, short_top=SHORT_TOP):
+    short_means = mean_quote_volumes(klines, window_start_ms(now_ms, SHORT_WINDOW_DAYS))
+    shortlist = top_symbols(short_means, short_top)
+    return mean_quote_volumes({symbol: klines[symbol] for symbol in shortlist},
+                              window_start_ms(now_ms, LONG_WINDOW_DAYS))
+
+
+def fetch_screening_window(symbols, now_ms, cache=None):
+    return fetch_klines_many(symbols, window_start_ms(now_ms, LONG_WINDOW_DAYS), end=now_ms, cache=cache)
+
+
+# trading symbols -> {symbol: score} of the shortlist, one klines request per screened symbol
+def screen_scores(symbols, cache=None, use_ticker_prefilter=True):
+    now_ms = server_clock.now_ms()
+    if use_ticker_prefilter:
+        try:
+            symbols = prefilter_by_ticker(symbols, get_24h_quote_volumes())
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logging.warning(f"⚠️ 24h ticker pre-filter failed, screening every symbol : {e}")
+    return score_symbols(fetch_screening_window(symbols, now_ms, cache), now_ms)
+
+
+# refresh cached scores by re-scoring only the ranks around the cutoff and symbols listed since
+# the last ranking; the clear leaders keep their scores and delisted symbols are dropped
+def rescore_near_cutoff(scores, trading_symbols, new_symbols=(), cache=None, margin=NEAR_CUTOFF_MARGIN):
+    trading = set(trading_symbols)
+    scores = {symbol: score for symbol, score in scores.items() if symbol in trading}
+    ranked = top_symbols(scores, len(scores))
+    band = ranked[max(LONG_TOP - margin, 0):LONG_TOP + margin] + [s for s in new_symbols if s in trading]
+    if not band:
+        return scores
+    now_ms = server_clock.now_ms()
+    fresh = mean_quote_volumes(fetch_screening_window(band, now_ms, cache), window_start_ms(now_ms, LONG_WINDOW_DAYS))
+    for symbol in band:
+        if symbol in fresh:
+            scores[symbol] = fresh[symbol]
+        else:
+            scores.pop(symbol, None)
+    logging.info(f"✅ re-scored {len(band)} symbols near the cutoff")
+    return scores
@@ -0,0 +1,81 @@
+# persistent cache of the exchangeInfo symbol list and of the screening scores
+#
+# one JSON file: the TRADING symbols with the time they were downloaded, and the 30-day mean quote
+# volume of the 14-day shortlist with the time it was ranked. Both expire after their own TTL,
+# the collector keeps using expired entries while it refreshes them
+
+import json
+import os
+import threading
+import time
+
+
+
+UNIVERSE_CACHE_FILE = os.getenv('UNIVERSE_CACHE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    'universe_cache.json'))
+EXCHANGE_INFO_TTL_SECONDS = int(os.getenv('EXCHANGE_INFO_TTL_SECONDS', 86400))
+RANKING_TTL_SECONDS = int(os.getenv('RANKING_TTL_SECONDS', 86400))
+# past this age the ranking is redone for every symbol instead of only near the cutoff
+FULL_RANKING_TTL_SECONDS = int(os.getenv('FULL_RANKING_TTL_SECONDS', 7 * 86400))
+
+
+
+class UniverseCache:
+
+    def __init__(self, path=UNIVERSE_CACHE_FILE, exchange_info_ttl=EXCHANGE_INFO_TTL_SECONDS,
+                 ranking_ttl=RANKING_TTL_SECONDS, full_ranking_ttl=FULL_RANKING_TTL_SECONDS):
+        self.path = path
+        self.exchange_info_ttl = exchange_info_ttl
+        self.ranking_ttl = ranking_ttl
+        self.full_ranking_ttl = full_ranking_ttl
+        # a background refresh and the collector may write at the same time
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, **fields):
+        with self._lock:
+            state = self.load()
+            state.update(fields)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def _age(self, key):
+        state = self.load()
+        return time.time() - state[key] if key in state else float('inf')
+
+    # TRADING symbols, None when they were never downloaded
+    def trading_symbols(self):
+        return self.load().get('trading_symbols')
+
+    def trading_symbols_fresh(self):
+        return self._age('exchange_info_at') <= self.exchange_info_ttl
+
+    def save_trading_symbols(self, symbols):
+        self._update(trading_symbols=list(symbols), exchange_info_at=time.time())
+
+    # {symbol: 30-day mean quote volume} of the shortlist, empty when never ranked
+    def scores(self):
+        return dict(self.load().get('scores', []))
+
+    def ranking_fresh(self):
+        return self._age('ranked_at') <= self.ranking_ttl
+
+    def full_ranking_fresh(self):
+        return self._age('fully_ranked_at') <= self.full_ranking_ttl
+
+    def save_scores(self, scores, full):
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        now = time.time()
+        fields = {'scores': [[symbol, float(score)] for symbol, score in ranked], 'ranked_at': now}
+        if full:
+            fields['fully_ranked_at'] = now
+        self._update(**fields)